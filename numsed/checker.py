@@ -12,9 +12,15 @@ The following is tested:
   divmod results must be assigned immediately.
 - unary operators are - and +
 - binary operators are -, +, *, //, % and **, divmod function is available
+- pow function is available with two or three arguments, with two
+  arguments only when the script is not transformed (--literal)
+- builtin functions isqrt, gcd, min, max and ndigits are available, unless
+  hidden by a definition of the script as in python
 - comparison operators are ==, !=, <, <=, >, and >=
 - boolean operators are or, and and not
 - functions are defined at module level
+- functions may be imported from numsed modules (from module import f),
+  modules containing only function definitions and imports
 - functions from numsed_lib may not be redefined
 - functions accept only positional arguments with no default value
 - names are the only callables accepted
@@ -24,6 +30,7 @@ The following is tested:
 """
 from __future__ import print_function
 
+import os
 import inspect
 import ast
 import re
@@ -39,28 +46,49 @@ FUTURE_FUNCTION = 'from __future__ import print_function\n'
 
 
 def check(source):
+    with open(source) as f:
+        script = f.read()
+    return check_text(script, common.source_directory(source))
+
+
+def check_text(script, directory=None, module=None, importing=(), literal=False):
+    """
+    Check a script, or a module if module is the name of the module. Imported
+    modules are searched in directory and are checked as well. importing is
+    the list of the modules being imported, to detect circular imports.
+    literal is True if the script is compiled without transformation.
+    """
     try:
-        with open(source) as f:
-            # compile to catch syntax errors
-            script = f.read()
-            code = compile(script, source, "exec")
+        # compile to catch syntax errors
+        code = compile(script, '<string>', "exec")
     except SyntaxError as e:
-        msg = 'SyntaxError: %s\nline %d: %s' % (e.args[0], e.args[1][1], e.args[1][3])
+        lineno, text = e.args[1][1], e.args[1][3]
+        if text is None:
+            # line not given by the parser, and not read from a file
+            text = script.splitlines(True)[lineno - 1]
+        msg = 'SyntaxError: %s\nline %d: %s' % (e.args[0], lineno, text)
         return False, msg
 
     tree = ast.parse(FUTURE_FUNCTION + script)
-    numsed_check_ast_visitor = NumsedCheckAstVisitor()
+    numsed_check_ast_visitor = NumsedCheckAstVisitor(directory, module, importing, literal)
     try:
         numsed_check_ast_visitor.visit(tree)
         return True, ''
     except CheckException as e:
         msg, node = e.args
         return False, error_message(msg, node, script)
+    except ModuleCheckException as e:
+        return False, e.args[0]
 
 
 def error_message(msg, node, script):
     script = script.splitlines()
 
+    # python 3.8 moved the position of parenthesized tuples to the opening
+    # parenthesis, point at the first element to report it on all versions
+    while isinstance(node, ast.Tuple) and node.elts:
+        node = node.elts[0]
+
     # remove the line added for from future
     lineno = node.lineno - 1
     # count column from 1
@@ -76,21 +104,70 @@ BINOP = (ast.Add, ast.Sub, ast.Mult, ast.FloorDiv, ast.Mod, ast.Pow,
          ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
 
 
+# list of functions defined in lib
+# used to check there is no redefinition
+LIB_FUNCTIONS = {x[0] for x in inspect.getmembers(numsed_lib, inspect.isfunction)}
+
+
 class NumsedCheckAstVisitor(ast.NodeVisitor):
 
-    def __init__(self):
-        # list of functions defined in lib
-        # used to check there is no redefinition
-        self.lib_functions = {x[0] for x in inspect.getmembers(numsed_lib, inspect.isfunction)}
+    def __init__(self, directory=None, module=None, importing=(), literal=False):
+        self.lib_functions = LIB_FUNCTIONS
+        self.directory = directory or os.getcwd()
+        self.module = module
+        self.importing = importing
+        self.literal = literal
+        # functions of imported modules and their module
+        self.module_functions = dict()
 
     def visit_Module(self, node):
         self.tree = node
         self.modulebody = node.body
+        self.builtin_calls = common.builtin_calls(node, numsed_lib.BUILTINS + ('pow',))
+        if self.module is not None:
+            for stmt in node.body:
+                if not isinstance(stmt, (ast.FunctionDef, ast.ImportFrom)):
+                    raise CheckException('only function definitions and imports allowed in modules', stmt)
         self.visit_child_nodes(node)
 
     def visit_ImportFrom(self, node):
-        # allow for print_function
-        pass
+        if node.module == '__future__':
+            # allow for print_function
+            return
+
+        if node not in self.modulebody:
+            raise CheckException('imports allowed only at module level', node)
+        if node.module in self.importing or node.module == self.module:
+            raise CheckException('circular import', node)
+        path = common.module_path(node.module, self.directory)
+        if not os.path.isfile(path):
+            raise CheckException('module not found', node)
+
+        with open(path) as f:
+            text = f.read()
+        checked, msg = check_text(text, self.directory, node.module,
+                                  self.importing + (node.module,), self.literal)
+        if checked is False:
+            raise ModuleCheckException(msg.replace(': ', ': module %s: ' % node.module, 1))
+
+        defined = defined_functions(text)
+        for alias in node.names:
+            if alias.asname is not None:
+                raise CheckException('import aliases not handled', node)
+            if alias.name not in defined:
+                raise CheckException('cannot import name %s' % alias.name, node)
+
+        # all functions of the module and of the modules it imports are linked
+        # with the script and must not conflict with names of the script
+        names = defined_names(self.tree)
+        for func, module in module_functions(node.module, self.directory):
+            other = self.module_functions.setdefault(func, module)
+            if other != module:
+                raise CheckException('function %s defined in modules %s and %s' %
+                                     (func, other, module), node)
+            if func in names:
+                raise CheckException('name %s conflicts with function of module %s' %
+                                     (func, module), node)
 
     def visit_Assign(self, node):
         def len_of_target(elt):
@@ -185,6 +262,10 @@ class NumsedCheckAstVisitor(ast.NodeVisitor):
                 self.visit_CallDivmod(node)
             elif node.func.id == 'exit':
                 self.visit_CallExit(node)
+            elif node.func.id == 'pow' and node in self.builtin_calls:
+                self.visit_CallPow(node)
+            elif node in self.builtin_calls:
+                self.visit_CallBuiltin(node)
             else:
                 self.visit_child_nodes(node)
         else:
@@ -208,6 +289,21 @@ class NumsedCheckAstVisitor(ast.NodeVisitor):
             raise CheckException('divmod results must be assigned immediately', node)
         self.visit_child_nodes(node)
 
+    def visit_CallPow(self, node):
+        if len(node.args) not in (2, 3):
+            raise CheckException('pow requires two or three arguments', node)
+        if len(node.args) == 3 and self.literal:
+            # modulo is not available in sed without transformation
+            raise CheckException('pow with three arguments not available with --literal, '
+                                 'use --unsigned or --signed', node)
+        self.visit_child_nodes(node)
+
+    def visit_CallBuiltin(self, node):
+        func = getattr(numsed_lib, 'builtin_' + node.func.id)
+        if len(node.args) != func.__code__.co_argcount:
+            raise CheckException('wrong number of arguments', node)
+        self.visit_child_nodes(node)
+
     def visit_CallExit(self, node):
         if len(node.args) > 0:
            raise CheckException('arguments are not allowed', node)
@@ -267,3 +363,39 @@ def parent_node(tree, node):
 
 class CheckException(Exception):
     pass
+
+
+class ModuleCheckException(Exception):
+    pass
+
+
+def defined_functions(text):
+    tree = ast.parse(FUTURE_FUNCTION + text)
+    return [node.name for node in tree.body if isinstance(node, ast.FunctionDef)]
+
+
+def defined_names(tree):
+    """
+    Return the names of the functions defined in a script and the names it
+    assigns.
+    """
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef):
+            names.add(node.name)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            names.add(node.id)
+    return names
+
+
+def module_functions(name, directory):
+    """
+    Return the functions defined in a module and in the modules it imports,
+    directly or not, with the names of their modules.
+    """
+    functions = []
+    with open(common.module_path(name, directory)) as f:
+        text = f.read()
+    for module, module_text in [(name, text)] + common.module_sources(text, directory):
+        functions.extend((func, module) for func in defined_functions(module_text))
+    return functions
@@ -1,26 +1,66 @@
 from __future__ import print_function
 
+import os
+import re
+import ast
 import sys
+import glob
+import json
+import hashlib
 import subprocess
+import tempfile
+import threading
 import time
+import types
 try:
     from StringIO import StringIO  # Python2
 except ImportError:
     from io import StringIO  # Python3
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Python2
 
 
 PY2 = sys.version_info < (3,)
 PY3 = sys.version_info > (3,)
 
-TMP_SED = 'tmp.sed'
-TMP_INPUT = 'tmp.input'
-TMP_PY = 'tmp.py'
-
 
 class NumsedConversion:
-    def __init__(self, source, transformation):
+    """
+    Conversion of a script. The source is the name of the script, its text
+    is read from the file if not given.
+    """
+    def __init__(self, source, transformation, context=None, text=None):
         self.source = source
         self.transformation = transformation
+        self.context = CompilerContext() if context is None else context
+        if text is None:
+            with open(source) as f:
+                text = f.read()
+        self.text = text
+
+    def directory(self):
+        return source_directory(self.source)
+
+    def cache_key(self, kind):
+        passes = [name for name in PASS_NAMES if self.context.runnable(name)]
+        return self.context.cache.key(kind, self.source.endswith('.opc'),
+                                      self.transformation, passes, self.context.compact,
+                                      self.text, module_sources(self.text, self.directory()))
+
+    def cached_lines(self, kind, generate):
+        """
+        Return an iterator on the lines of a result of the conversion. The
+        lines are read from the cache, or generated by the function generate
+        and stored in the cache.
+        """
+        cache = self.context.cache
+        if cache is None:
+            return generate()
+        key = self.cache_key(kind)
+        path = cache.lookup(key) or cache.store(key, generate())
+        return read_lines(path)
 
     def trace(self):
         return ''
@@ -38,40 +78,124 @@ class NumsedConversion:
 class ListStream:
     def __enter__(self):
         self.result = StringIO()
+        self.stdout = sys.stdout
         sys.stdout = self.result
         return self
     def __exit__(self, ext_type, exc_value, traceback):
-        sys.stdout = sys.__stdout__
+        sys.stdout = self.stdout
     def stringlist(self):
         return self.result.getvalue().splitlines()
     def singlestring(self):
         return self.result.getvalue()
 
 
-def run(cmd, echo=True):
+def start(cmd):
+    # cmd is the list of the program and its arguments, arguments may contain
+    # spaces (e.g. the paths of temporary files)
     try:
-        p = subprocess.Popen(cmd.split(),
-                            #shell=True,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.STDOUT)
+        return subprocess.Popen(cmd,
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
     except:
-        print('Unable to start', cmd)
+        print('Unable to start', ' '.join(cmd))
         exit(1)
 
-    res = []
-    while True:
-        line = p.stdout.readline()
-        line = line.decode('ascii') # py3
-        if line == '':
-            break
-        else:
-            line = line.rstrip('\n\r')
-            res.append(line)
-            if echo:
-                print(line)
+
+def run(cmd, echo=True, input=''):
+    """
+    Run a command, given as a list of arguments, with input as standard input
+    and return its output. The output is read at once, and printed if echo is
+    True.
+    """
+    return communicate(start(cmd), echo, input)
+
+
+def communicate(p, echo=True, input=''):
+    """
+    Send input to a started command, wait for its end and return its output,
+    printed if echo is True.
+    """
+    # input is written by a thread, as by Popen.communicate, but the process
+    # is waited for by wait() to get its peak memory
+    writer = threading.Thread(target=write_input, args=(p, input))
+    writer.start()
+    output = p.stdout.read()
+    p.stdout.close()
+    writer.join()
+    wait(p)
+    res = [line.rstrip('\r') for line in output.decode('ascii').split('\n')]
+    if res[-1] == '':
+        res.pop()
+    if echo and res:
+        print('\n'.join(res))
     return '\n'.join(res)
 
 
+def run_lines(cmd, input=''):
+    """
+    Run a command, given as a list of arguments, with input as standard input
+    and yield the lines of its output as soon as they are read, for live
+    display.
+    """
+    return output_lines(start(cmd), input)
+
+
+def output_lines(p, input=''):
+    # yield the output lines of a started command
+    write_input(p, input)
+    for line in iter(p.stdout.readline, b''):
+        yield line.decode('ascii').rstrip('\n\r')
+    p.stdout.close()
+    wait(p)
+
+
+def write_input(p, input):
+    try:
+        p.stdin.write(input.encode('ascii'))
+        p.stdin.close()
+    except IOError:
+        # the command ended without reading all its input
+        pass
+
+
+def wait(p):
+    """
+    Wait for the end of a started command. The peak resident size of its
+    process, in kilobytes, is set in p.peak_memory, 0 when not available.
+    """
+    p.peak_memory = 0
+    if not hasattr(os, 'wait4'):
+        # Windows
+        p.wait()
+        return
+    _, status, usage = os.wait4(p.pid, 0)
+    if os.WIFSIGNALED(status):
+        p.returncode = -os.WTERMSIG(status)
+    else:
+        p.returncode = os.WEXITSTATUS(status)
+    # ru_maxrss is given in bytes by macOS
+    p.peak_memory = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+
+
+class TemporaryFile:
+    """
+    Private temporary file, written when entering by the function write
+    taking a file object, and removed when leaving. The name of the file is
+    returned when entering.
+    """
+    def __init__(self, suffix, write):
+        self.suffix = suffix
+        self.write = write
+    def __enter__(self):
+        fd, self.path = tempfile.mkstemp(suffix=self.suffix, prefix='numsed-')
+        with os.fdopen(fd, 'w') as f:
+            self.write(f)
+        return self.path
+    def __exit__(self, ext_type, exc_value, traceback):
+        os.remove(self.path)
+
+
 def testlines(name):
     '''
     yield each test in a test suite
@@ -116,3 +240,544 @@ def list_compare(tag1, tag2, list1, list2):
     return res, diff
 
 
+# -- Modules -----------------------------------------------------------------
+
+
+IMPORT_REGEX = re.compile(r'^from +(\w+) +import\b', re.MULTILINE)
+
+
+def source_directory(source):
+    # modules are searched in the directory of the script, or in the current
+    # directory for scripts given as text
+    if os.path.isfile(source):
+        return os.path.dirname(os.path.abspath(source))
+    else:
+        return os.getcwd()
+
+
+def module_path(name, directory):
+    return os.path.join(directory, name + '.py')
+
+
+def module_sources(text, directory):
+    """
+    Return the names and texts of the modules imported by a script, directly
+    or not, in order of import. Missing modules are reported by the checker
+    and are ignored.
+    """
+    sources = []
+    names = set()
+    pending = [text]
+    while pending:
+        for name in IMPORT_REGEX.findall(pending.pop(0)):
+            path = module_path(name, directory)
+            if name != '__future__' and name not in names and os.path.isfile(path):
+                names.add(name)
+                with open(path) as f:
+                    sources.append((name, f.read()))
+                pending.append(sources[-1][1])
+    return sources
+
+
+class ModulePath:
+    """
+    Make the modules of a directory importable while running a python
+    script. Modules imported from the directory are removed when leaving,
+    so they are imported again if modified.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+    def __enter__(self):
+        self.modules = set(sys.modules)
+        sys.path.insert(0, self.directory)
+        return self
+    def __exit__(self, ext_type, exc_value, traceback):
+        sys.path.remove(self.directory)
+        for name in set(sys.modules) - self.modules:
+            path = getattr(sys.modules[name], '__file__', None)
+            if path and os.path.dirname(os.path.abspath(path)) == self.directory:
+                del sys.modules[name]
+
+
+# -- Builtins ----------------------------------------------------------------
+
+
+def builtin_calls(tree, builtins):
+    """
+    Return the calls of builtins in the AST of a script, less the calls of
+    names defined by the script, which hide builtins as in python. A name is
+    hidden everywhere if it is defined at module level: function, import,
+    assignment, or assignment in a function declaring it global. It is
+    hidden in a function if it is an argument or is assigned there.
+    """
+    def scope_nodes(nodes):
+        # nodes of a scope, less the nodes of the functions defined in it
+        pending = list(nodes)
+        while pending:
+            node = pending.pop()
+            yield node
+            if not isinstance(node, ast.FunctionDef):
+                pending.extend(ast.iter_child_nodes(node))
+
+    def stored_names(nodes):
+        return {node.id for node in nodes
+                if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store)}
+
+    def calls(nodes, hidden):
+        return {node for node in nodes
+                if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+                node.func.id in builtins and node.func.id not in hidden}
+
+    module_nodes = list(scope_nodes(tree.body))
+    functions = [node for node in module_nodes if isinstance(node, ast.FunctionDef)]
+    function_nodes = [list(scope_nodes(node.body)) for node in functions]
+
+    hidden = stored_names(module_nodes)
+    for node in module_nodes:
+        if isinstance(node, ast.FunctionDef):
+            hidden.add(node.name)
+        elif isinstance(node, ast.ImportFrom):
+            hidden.update(alias.asname or alias.name for alias in node.names)
+    global_names = [set() for _ in functions]
+    for names, nodes in zip(global_names, function_nodes):
+        for node in nodes:
+            if isinstance(node, ast.Global):
+                names.update(node.names)
+        hidden |= names
+
+    result = calls(module_nodes, hidden)
+    for node, names, nodes in zip(functions, global_names, function_nodes):
+        # arguments are ast.Name with python 2, ast.arg with python 3
+        arguments = {getattr(arg, 'arg', None) or arg.id for arg in node.args.args}
+        local_names = (stored_names(nodes) - names) | arguments
+        result |= calls(nodes, hidden | local_names)
+    return result
+
+
+# -- Passes ------------------------------------------------------------------
+
+
+DEFAULT_OPTIMIZATION_LEVEL = 2
+MAX_OPTIMIZATION_LEVEL = 3
+
+# all passes by name, in order of registration
+PASSES = dict()
+PASS_NAMES = []
+
+
+class Pass(object):
+    __slots__ = ('name', 'func', 'level', 'requires')
+
+    def __init__(self, name, func, level, requires):
+        self.name = name
+        self.func = func
+        self.level = level
+        self.requires = requires
+
+
+class PassManager(object):
+    """
+    Ordered sequence of passes transforming one representation of the
+    program (AST, opcodes, sed). A pass is a function taking the program and
+    returning the transformed program, possibly as a generator. Passes
+    with level 0 are always required, other passes are optimizations enabled
+    from their optimization level. A pass is run only if the passes it
+    requires are run. The passes to run, the dump and the timings are given
+    by the compilation context. Passes are timed in the phase of the
+    manager, or in a phase named as the pass if the manager has none. The
+    time of lazy passes is measured while their result is consumed.
+    """
+    def __init__(self, formatter, phase=None):
+        self.formatter = formatter
+        self.phase = phase
+        self.passes = []
+
+    def register(self, name, func, level=0, requires=()):
+        assert name not in PASSES, name
+        x = Pass(name, func, level, requires)
+        self.passes.append(x)
+        PASSES[name] = x
+        PASS_NAMES.append(name)
+
+    def run(self, program, context, *args):
+        for x in self.passes:
+            if context.runnable(x.name):
+                phase = self.phase or x.name
+                with context.timings.phase(phase):
+                    program = x.func(program, *args)
+                if isinstance(program, types.GeneratorType):
+                    program = context.timings.iterate(phase, program)
+            if x.name == context.dump_after:
+                if isinstance(program, types.GeneratorType):
+                    # lazy pass, keep the program for the next passes
+                    program = list(program)
+                context.dump = self.formatter(program)
+        return program
+
+
+class CompilerContext(object):
+    """
+    State of a compilation: configuration of passes, dump, timings and label
+    counters. Compilations do not share any mutable state and may run
+    concurrently with distinct contexts. Labels are numbered from zero in
+    each context, hence compiling a script always gives the same result.
+
+    fragments is a dictionary of the code of functions, indexed by their
+    definition. Successive compilations of a script may share it to compile
+    only the functions modified since the previous compilation.
+    """
+    def __init__(self, level=DEFAULT_OPTIMIZATION_LEVEL, enabled=(), disabled=(),
+                 dump_after=None, cache=None, fragments=None, compact=False):
+        self.level = level
+        self.enabled = set(enabled)
+        self.disabled = set(disabled)
+
+        # integers are stored in variables as compact values (--compact)
+        self.compact = compact
+
+        # name of the pass after which the program is dumped, and dump
+        self.dump_after = dump_after
+        self.dump = None
+
+        self.timings = Timings()
+        self.cache = cache
+        self.modules = dict()
+        self.fragments = dict() if fragments is None else fragments
+        self.label_prefix = ''
+        self.label_counter = 0
+        self.return_labels = []
+
+    def enabled_pass(self, name):
+        x = PASSES[name]
+        if x.name in self.disabled and x.level > 0:
+            return False
+        else:
+            return x.level <= self.level or x.name in self.enabled
+
+    def runnable(self, name):
+        return (self.enabled_pass(name) and
+                all(self.runnable(x) for x in PASSES[name].requires))
+
+    def new_label(self):
+        label = '%sL%d' % (self.label_prefix, self.label_counter)
+        self.label_counter += 1
+        return label
+
+    def new_return_label(self):
+        label = '%sR%d' % (self.label_prefix, len(self.return_labels))
+        self.return_labels.append(label)
+        return label
+
+
+def check_pass_names(names):
+    for name in names:
+        if name not in PASSES:
+            return 'numsed.py: error: unknown pass: %s' % name
+    return None
+
+
+# phases of the compilation and of the run of a script, in order
+PHASES = ('checking', 'transform', 'dis', 'opcode', 'expand', 'prettyprint',
+          'sed_spawn', 'sed_run')
+
+
+# phases run by another process, their memory is the one of the process
+PROCESS_PHASES = ('sed_run',)
+
+
+class Timings(object):
+    """
+    Wall time and peak memory of the phases of the compilation and of the
+    run of a script. The time of a phase does not include the time of the
+    phases nested in it, hence the times of a lazy pass and of the pass
+    consuming its result are separated. The peak memory of a phase, in
+    kilobytes, is the peak of memory allocated by python while the phase
+    runs, above the memory in use when it starts or resumes after a nested
+    phase. It is measured when allocations are traced (MemoryTracing), and
+    is 0 otherwise. The peak memory of process phases is the peak resident
+    size of the process, given by process_memory().
+    """
+    def __init__(self):
+        self.times = dict((name, 0.0) for name in PHASES)
+        self.memory = dict((name, 0) for name in PHASES)
+        self.nested = []
+        self.running = []
+        self.baseline = 0
+
+    def phase(self, name):
+        return TimedPhase(self, name)
+
+    def start(self, name):
+        # time of nested phases is added when they stop
+        self.nested.append(0.0)
+        self.measure()
+        self.running.append(name)
+        return time.time()
+
+    def stop(self, name, t0):
+        elapsed = time.time() - t0
+        self.times[name] += elapsed - self.nested.pop()
+        if self.nested:
+            self.nested[-1] += elapsed
+        self.measure()
+        self.running.pop()
+
+    def measure(self):
+        # peak memory of the running phase since the previous measure, the
+        # peak is then reset for the phase run next
+        if tracemalloc is None or not tracemalloc.is_tracing():
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        if self.running and self.running[-1] not in PROCESS_PHASES:
+            name = self.running[-1]
+            self.memory[name] = max(self.memory[name], (peak - self.baseline) // 1024)
+        if hasattr(tracemalloc, 'reset_peak'):
+            # Python 3.9
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.clear_traces()
+        self.baseline = tracemalloc.get_traced_memory()[0]
+
+    def process_memory(self, name, p):
+        # peak memory of a process phase, once the process is waited for
+        self.memory[name] = max(self.memory[name], getattr(p, 'peak_memory', 0))
+
+    def iterate(self, name, iterable):
+        # time spent in a lazy phase each time an item is requested
+        iterator = iter(iterable)
+        while True:
+            t0 = self.start(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.stop(name, t0)
+            yield item
+
+    def lines(self):
+        lines = ['%-12s %9s %10s' % ('phase', 'time (s)', 'peak (kB)')]
+        for name in PHASES:
+            lines.append('%-12s %9.3f %10d' % (name, self.times[name], self.memory[name]))
+        lines.append('%-12s %9.3f' % ('total', sum(self.times.values())))
+        return lines
+
+    def json(self):
+        return json.dumps([{'phase': name,
+                            'time': round(self.times[name], 6),
+                            'peak_memory': self.memory[name]} for name in PHASES])
+
+
+class TimedPhase:
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+    def __enter__(self):
+        self.t0 = self.timings.start(self.name)
+    def __exit__(self, ext_type, exc_value, traceback):
+        self.timings.stop(self.name, self.t0)
+
+
+class MemoryTracing:
+    """
+    Trace memory allocations of python between entering and leaving, for
+    the peak memory of timings. Nothing is done with Python2.
+    """
+    def __enter__(self):
+        self.started = tracemalloc is not None and not tracemalloc.is_tracing()
+        if self.started:
+            tracemalloc.start()
+    def __exit__(self, ext_type, exc_value, traceback):
+        if self.started:
+            tracemalloc.stop()
+
+
+def list_passes(context):
+    lines = []
+    for name in PASS_NAMES:
+        x = PASSES[name]
+        line = '%-20s -O%d %-4s %s' % (name, x.level, 'on' if context.runnable(name) else 'off',
+                                      ' '.join(x.requires))
+        lines.append(line.rstrip())
+    return '\n'.join(lines)
+
+
+# -- Compilation cache -------------------------------------------------------
+
+
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME',
+                                        os.path.join(os.path.expanduser('~'), '.cache')),
+                         'numsed')
+CACHE_SIZE = 100 * 1024 * 1024
+
+# hash of the sources of the compiler, computed once
+compiler_digest = None
+
+
+def compiler_hash():
+    """
+    Return a hash of the sources of numsed. Cached results are invalidated
+    when the compiler, including its version number, is modified.
+    """
+    global compiler_digest
+    if compiler_digest is None:
+        h = hashlib.sha1()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(glob.glob(os.path.join(directory, '*.py'))):
+            with open(name, 'rb') as f:
+                h.update(f.read())
+        compiler_digest = h.hexdigest()
+    return compiler_digest
+
+
+class CompilationCache(object):
+    """
+    Content addressed cache of compilation results. Each result is stored in
+    a file named after a hash of the compiler, of the python interpreter, of
+    the text of the script and of the options of the compilation. The size of
+    the cache is bounded, the least recently used results being removed
+    first. Results are written in temporary files and renamed, so several
+    processes may share the cache.
+    """
+    def __init__(self, directory=CACHE_DIR, max_size=CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    def key(self, *args):
+        h = hashlib.sha1(compiler_hash().encode('ascii'))
+        # opcodes and results of scripts depend on the interpreter
+        h.update(repr((tuple(sys.version_info), sys.executable)).encode('utf-8'))
+        h.update(repr(args).encode('utf-8'))
+        return h.hexdigest()
+
+    def lookup(self, key):
+        """
+        Return the path of the result with the given key, or None if the
+        result is not in the cache.
+        """
+        path = os.path.join(self.directory, key)
+        try:
+            # mark as recently used
+            os.utime(path, None)
+            return path
+        except OSError:
+            return None
+
+    def store(self, key, lines):
+        """
+        Write lines, as they are generated, as the result with the given key
+        and return the path of the result.
+        """
+        make_directory(self.directory)
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                for line in lines:
+                    f.write(line)
+                    f.write('\n')
+        except:
+            os.remove(tmp)
+            raise
+
+        path = os.path.join(self.directory, key)
+        try:
+            replace_file(tmp, path)
+        except OSError:
+            # same result already stored by another process (Python 2 under
+            # Windows does not replace files)
+            os.remove(tmp)
+        self.evict(keep=key)
+        return path
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used results until the size of the cache
+        is below its maximum size.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp') or name == keep:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        if keep is not None:
+            size += os.path.getsize(os.path.join(self.directory, keep))
+
+        for _, entry_size, name in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            size -= entry_size
+
+
+replace_file = getattr(os, 'replace', os.rename)
+
+
+def make_directory(directory):
+    try:
+        os.makedirs(directory)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+
+
+def read_lines(path):
+    with open(path) as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+
+class TestDurations(object):
+    """
+    Durations of the tests of a suite, or of the lines of a batch, in their
+    last run. Durations are stored in the cache directory with the results
+    of compilations, and may be evicted as well. Tests are identified by
+    their text.
+    """
+    def __init__(self, name, directory=CACHE_DIR):
+        self.directory = directory
+        self.path = os.path.join(directory, 'durations-' + text_hash(name))
+        self.previous = dict()
+        self.current = dict()
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    key, duration = line.split()
+                    self.previous[key] = float(duration)
+        except (IOError, OSError, ValueError):
+            pass
+
+    def duration(self, text):
+        # tests never run are scheduled first
+        return self.previous.get(text_hash(text), float('inf'))
+
+    def record(self, text, duration):
+        self.current[text_hash(text)] = duration
+
+    def save(self):
+        """
+        Store the durations of the tests run, durations of other tests are
+        forgotten.
+        """
+        try:
+            make_directory(self.directory)
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+            with os.fdopen(fd, 'w') as f:
+                for key, duration in sorted(self.current.items()):
+                    print(key, '%.3f' % duration, file=f)
+            replace_file(tmp, self.path)
+        except (IOError, OSError):
+            pass
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
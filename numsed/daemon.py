@@ -0,0 +1,228 @@
+"""
+numsed compile server and its client.
+
+The server keeps the compiler loaded, with its library fragments and the code
+of compiled functions in memory. The client sends its command line and
+current directory through a Unix socket and receives the output of numsed.
+The client imports only standard modules, hence it starts quickly.
+
+Usage (client)   daemon.py [--socket PATH] <numsed arguments>
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import stat
+import errno
+import signal
+import socket
+import struct
+import tempfile
+import traceback
+
+
+# maximum number of fragments and templates kept in memory by the server,
+# a few megabytes. Past it, all of them are cleared.
+MAX_ENTRIES = 5000
+
+# options of the command line refused from clients
+SERVER_OPTIONS = ('--serve', '--watch', '--profile-compiler')
+
+
+def socket_path():
+    # default socket, in a directory private to the user
+    return os.path.join(tempfile.gettempdir(), 'numsed-%d' % os.getuid(), 'server.sock')
+
+
+def private_directory(path):
+    """
+    Create the directory path, accessible only by the user, or check an
+    existing one is.
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    st = os.lstat(path)
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or
+            st.st_mode & (stat.S_IRWXG | stat.S_IRWXO)):
+        raise Exception('numsed error: %s is not a private directory' % path)
+
+
+def receive(connection):
+    chunks = []
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def send(connection, message):
+    connection.sendall(json.dumps(message).encode('utf-8'))
+    connection.shutdown(socket.SHUT_WR)
+
+
+# -- Server ------------------------------------------------------------------
+
+
+def serve(path, command, memos=()):
+    """
+    Serve requests on the socket path until interrupted. command is the
+    function processing a numsed command line, it is called with the
+    arguments of the client and the fragments kept between requests.
+    memos are the other dictionaries filled by the compiler and kept between
+    requests, cleared with the fragments.
+    Requests are processed one at a time, in the directory of the client.
+    Only processes of the user may connect.
+    """
+    if path == socket_path():
+        private_directory(os.path.dirname(path))
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    bind(server, path)
+    server.listen(5)
+    print('numsed: serving on', path)
+    sys.stdout.flush()
+
+    # the socket is removed when terminated as when interrupted
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    fragments = dict()
+    memos = [fragments] + list(memos)
+    try:
+        while True:
+            connection, _ = server.accept()
+            try:
+                if peer_uid(connection) != os.getuid():
+                    continue
+                request = receive(connection)
+                if sum(len(memo) for memo in memos) > MAX_ENTRIES:
+                    for memo in memos:
+                        memo.clear()
+                send(connection, process_request(request, command, fragments))
+            except Exception:
+                traceback.print_exc()
+            finally:
+                connection.close()
+    except KeyboardInterrupt:
+        return True
+    finally:
+        server.close()
+        os.remove(path)
+
+
+def bind(server, path):
+    # the socket is created readable and writable by the user only
+    umask = os.umask(0o177)
+    try:
+        try:
+            server.bind(path)
+        except socket.error as e:
+            if e.errno != errno.EADDRINUSE:
+                raise
+            # replace the socket of a previous server of the user, but no
+            # other file
+            st = os.lstat(path)
+            if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+                raise
+            os.remove(path)
+            server.bind(path)
+    finally:
+        os.umask(umask)
+
+
+def peer_uid(connection):
+    # user of the client process, when given by the system
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return os.getuid()
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                        struct.calcsize('3i'))
+    _, uid, _ = struct.unpack('3i', credentials)
+    return uid
+
+
+def server_option(arg):
+    # argparse accepts unambiguous prefixes of options and --option=value
+    name = arg.split('=', 1)[0]
+    return len(name) > 2 and any(option.startswith(name) for option in SERVER_OPTIONS)
+
+
+def process_request(request, command, fragments):
+    args = request['args']
+    if any(server_option(arg) for arg in args):
+        return {'output': 'numsed error: %s not available from client\n' %
+                          ', '.join(SERVER_OPTIONS),
+                'status': 1}
+
+    cwd = os.getcwd()
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = output = OutputStream()
+    try:
+        os.chdir(request['cwd'])
+        status = 0 if command(' '.join(args), fragments) else 1
+    except SystemExit as e:
+        # command line errors
+        status = e.code if isinstance(e.code, int) else 1
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        os.chdir(cwd)
+    return {'output': output.getvalue(), 'status': status}
+
+
+class OutputStream(object):
+    # text stream accepting both str and unicode with Python 2
+    def __init__(self):
+        self.chunks = []
+    def write(self, text):
+        self.chunks.append(text)
+    def flush(self):
+        pass
+    def isatty(self):
+        return False
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+
+# -- Client ------------------------------------------------------------------
+
+
+def request(path, args):
+    """
+    Send a numsed command line to the server listening on path, and return
+    its output and exit status.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+        send(connection, {'cwd': os.getcwd(), 'args': args})
+        response = receive(connection)
+    finally:
+        connection.close()
+    return response['output'], response['status']
+
+
+def main():
+    args = sys.argv[1:]
+    path = socket_path()
+    if '--socket' in args[:-1]:
+        index = args.index('--socket')
+        path = args[index + 1]
+        del args[index:index + 2]
+    try:
+        output, status = request(path, args)
+    except socket.error:
+        print('numsed error: no server listening on', path)
+        sys.exit(1)
+    sys.stdout.write(output)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,27 +5,34 @@ numsed: compiling python to sed
 from __future__ import print_function
 
 import argparse
+import cProfile
 import os
 import sys
+import multiprocessing
 import webbrowser
 import glob
 import subprocess
 import time
+import traceback
 
 try:
     import common
+    import numsed_lib
     import checker
     import transformer
     import opcoder
     import sedcode
     import snippet_test
+    import daemon
 except:
     from . import common
+    from . import numsed_lib
     from . import checker
     from . import transformer
     from . import opcoder
     from . import sedcode
     from . import snippet_test
+    from . import daemon
 
 
 VERSION = '0.21'
@@ -45,6 +52,7 @@ def parse_command_line(argstring=None):
     xgroup = agroup.add_mutually_exclusive_group()
     xgroup.add_argument('-h', help='show this help message', action='store_true', dest='help')
     xgroup.add_argument('-H', help='open full help page', action='store_true', dest='fullhelp')
+    xgroup.add_argument('--passes', help='list compilation passes', action='store_true')
 
     agroup = parser.add_argument_group('Actions')
     xgroup = agroup.add_mutually_exclusive_group()
@@ -54,6 +62,9 @@ def parse_command_line(argstring=None):
     xgroup.add_argument("--test", help="run conversion and compare with original python script", action="store_true")
     xgroup.add_argument("--snippets", help="test snippets", action="store_true")
     xgroup.add_argument("--batch", help="batch test", action="store_true")
+    agroup.add_argument("--watch", help="run or trace script again each time it is modified", action="store_true")
+    agroup.add_argument("--jobs", help="number of tests or batch lines run in parallel (default 1)", action="store", type=int, default=1, metavar='N')
+    agroup.add_argument("--single-sed", help="run the tests of a suite in a single sed process (--sed --test only)", action="store_true", dest='single_sed')
 
     agroup = parser.add_argument_group('Formats')
     xgroup = agroup.add_mutually_exclusive_group()
@@ -62,13 +73,36 @@ def parse_command_line(argstring=None):
     xgroup.add_argument("--disassembly", help="generate disassembly", action="store_true")
     xgroup.add_argument("--opcode", help="generate numsed intermediate opcode", action="store_true")
     xgroup.add_argument("--sed", help="generate sed script (default)", action="store_true")
+    agroup.add_argument("--compact", help="store integers in variables as compact values (--sed only)", action="store_true")
 
     agroup = parser.add_argument_group('Transformations')
     xgroup = agroup.add_mutually_exclusive_group()
     xgroup.add_argument("--literal", help="no program transformation", action="store_true")
-    xgroup.add_argument("--unsigned", help="replace division, modulo and power by functions", action="store_true")
+    xgroup.add_argument("--unsigned", help="replace division and modulo by functions", action="store_true")
     xgroup.add_argument("--signed", help="replace all operators by functions (default)", action="store_true")
 
+    agroup = parser.add_argument_group('Optimizations')
+    agroup.add_argument('-O', help='optimization level, from -O0 to -O%d (default -O%d)' %
+                        (common.MAX_OPTIMIZATION_LEVEL, common.DEFAULT_OPTIMIZATION_LEVEL),
+                        type=int, choices=range(common.MAX_OPTIMIZATION_LEVEL + 1),
+                        default=common.DEFAULT_OPTIMIZATION_LEVEL, dest='level', metavar='LEVEL')
+    agroup.add_argument('--with', help='enable comma separated list of passes', action='append', default=[], dest='enable', metavar='PASSES')
+    agroup.add_argument('--without', help='disable comma separated list of passes', action='append', default=[], dest='disable', metavar='PASSES')
+    agroup.add_argument('--dump-after', help='trace program after pass (--trace only)', action='store', dest='dump_after', metavar='PASS')
+
+    agroup = parser.add_argument_group('Cache')
+    agroup.add_argument('--no-cache', help='compile without reading or storing compilation results', action='store_true', dest='no_cache')
+    agroup.add_argument('--force', help='run tests even if their results are cached (--test only)', action='store_true')
+
+    agroup = parser.add_argument_group('Profiling')
+    agroup.add_argument('--timings', help='report time and peak memory of compilation and run phases (--run, --trace or --test)', action='store_true')
+    agroup.add_argument('--timings-json', help='report timings as JSON', action='store_true', dest='timings_json')
+    agroup.add_argument('--profile-compiler', help='profile numsed with cProfile and write statistics to FILE', action='store', dest='profile_compiler', metavar='FILE')
+
+    agroup = parser.add_argument_group('Server')
+    agroup.add_argument('--serve', help='serve compilation requests of numsed clients', action='store_true')
+    agroup.add_argument('--socket', help='socket of the server (default numsed-<uid>/server.sock in the temporary directory)', action='store', metavar='PATH')
+
     # do not use, it is intended to pass batch directory ni batch mode
     parser.add_argument("--batchdir", help=argparse.SUPPRESS, action="store")
 
@@ -79,7 +113,7 @@ def parse_command_line(argstring=None):
     else:
         args = parser.parse_args(argstring.split())
 
-    information = (args.help, args.fullhelp)
+    information = (args.help, args.fullhelp, args.passes, args.serve)
 
     actions = (args.trace, args.run, args.coverage, args.test, args.batch, args.snippets)
     if not any(actions):
@@ -107,6 +141,54 @@ def parse_command_line(argstring=None):
         print('numsed.py: error: argument --coverage requires argument --opcode')
         parser.exit(1)
 
+    args.enable = [x for arg in args.enable for x in arg.split(',')]
+    args.disable = [x for arg in args.disable for x in arg.split(',')]
+    msg = common.check_pass_names(args.enable + args.disable + [args.dump_after or 'prepare'])
+    if msg:
+        print(msg)
+        parser.exit(1)
+
+    if [x for x in args.disable if common.PASSES[x].level == 0]:
+        print('numsed.py: error: required passes cannot be disabled')
+        parser.exit(1)
+
+    if args.dump_after and not args.trace:
+        print('numsed.py: error: argument --dump-after requires argument --trace')
+        parser.exit(1)
+
+    if args.force and not args.test:
+        print('numsed.py: error: argument --force requires argument --test')
+        parser.exit(1)
+
+    if args.single_sed and not (args.sed and args.test):
+        print('numsed.py: error: argument --single-sed requires arguments --sed and --test')
+        parser.exit(1)
+
+    args.timings = args.timings or args.timings_json
+    if args.timings and not (args.run or args.trace or args.test):
+        print('numsed.py: error: argument --timings requires argument --run, --trace or --test')
+        parser.exit(1)
+
+    if args.timings and args.single_sed:
+        print('numsed.py: error: argument --timings not available with --single-sed')
+        parser.exit(1)
+
+    if args.profile_compiler and args.jobs > 1:
+        print('numsed.py: error: argument --profile-compiler requires a single job')
+        parser.exit(1)
+
+    if args.jobs < 1:
+        print('numsed.py: error: argument --jobs requires a positive number')
+        parser.exit(1)
+
+    if args.watch and not (args.run or args.trace):
+        print('numsed.py: error: argument --watch requires argument --run or --trace')
+        parser.exit(1)
+
+    if args.watch and (args.source.endswith('.suite.py') or not args.source.endswith('.py')):
+        print('numsed.py: error: argument --watch requires a python script')
+        parser.exit(1)
+
     if args.batch:
         # if batch, tests are looked for in batch directory
         args.batchdir = os.path.dirname(args.source)
@@ -139,6 +221,17 @@ def transformation(args):
         return None
 
 
+def compiler_context(args, fragments=None):
+    # passes are not run when results are cached, hence no cache with dumps
+    # or timings
+    if args.no_cache or args.dump_after or args.timings:
+        cache = None
+    else:
+        cache = common.CompilationCache()
+    return common.CompilerContext(args.level, args.enable, args.disable, args.dump_after,
+                                  cache, fragments, args.compact)
+
+
 def numsed_conversion(args):
     if args.ast:
         return transformer.AstAssertConversion
@@ -154,22 +247,104 @@ def numsed_conversion(args):
         return None
 
 
-def process_script(args, source, expected_result=None):
+LITERAL = transformer.LITERAL
+UNSIGNED = transformer.UNSIGNED
+SIGNED = transformer.SIGNED
+
+TARGETS = {
+    'opcode': opcoder.OpcodeConversion,
+    'sed': sedcode.SedConversion
+}
+
+
+class CompileException(checker.CheckException):
+    """
+    Raised by compile_script() if the script is not compliant with numsed
+    syntax. The message is the error message of numsed.
+    """
+    pass
+
 
-    checked, msg = checker.check(source)
+class Program(object):
+    """
+    Script compiled by compile_script(). Opcodes and sed code are given as text,
+    the sed script being generated each time it is requested.
+    """
+    def __init__(self, conversion, target):
+        self.conversion = conversion
+        self.target = target
+
+    @property
+    def opcodes(self):
+        return '\n'.join(opcoder.format_code(self.conversion.opcode))
+
+    @property
+    def sed(self):
+        return '\n'.join(sedcode.sedcode(self.conversion.opcode, self.conversion.context))
+
+    def run(self):
+        """
+        Run the compiled script with the interpreter of opcodes or with sed
+        depending on the target, and return its output.
+        """
+        if self.target == 'sed':
+            return sedcode.run_sed(self.conversion, echo=False)
+        else:
+            return self.conversion.run()
+
+
+def compile_script(source, mode=SIGNED, target='sed', level=common.DEFAULT_OPTIMIZATION_LEVEL,
+                   enabled=(), disabled=(), cache=None):
+    """
+    Compile a python script given as a string. No file is read or written,
+    except in the cache if a compilation cache is given. CompileException is
+    raised if the script is not compliant with numsed syntax.
+    """
+    checked, msg = checker.check_text(source, literal=mode == LITERAL)
+    if checked is False:
+        raise CompileException(msg)
+    context = common.CompilerContext(level, enabled, disabled, cache=cache)
+    return Program(TARGETS[target]('<string>', mode, context, source), target)
+
+
+def process_script(args, source, expected_result=None, text=None, fragments=None,
+                   run_result=None):
+
+    if text is None:
+        with open(source) as f:
+            text = f.read()
+
+    context = compiler_context(args, fragments)
+    with context.timings.phase('checking'):
+        checked, msg = checker.check_text(text, common.source_directory(source),
+                                          literal=args.literal)
 
     if args.test:
-        return test_script(args, source, expected_result, checked, msg)
+        return test_script(args, source, text, expected_result, checked, msg, run_result,
+                           context)
     elif checked is False:
         print(msg)
         return ''
     else:
         conversion = numsed_conversion(args)
-        target = conversion(source, transformation(args))
-        if args.run:
+        target = conversion(source, transformation(args), context, text)
+        if args.run and args.sed and sys.stdout.isatty():
+            # display output while sed is running
+            x = []
+            for line in sedcode.run_sed_lines(target):
+                print(line)
+                x.append(line)
+            x = '\n'.join(x)
+        elif args.run:
             x = target.run()
         elif args.coverage:
             x = target.coverage()
+        elif args.trace and args.dump_after:
+            # sed passes are run when the script is generated
+            target.trace()
+            x = target.context.dump
+            if x is None:
+                x = 'numsed error: pass %s not run for this format' % args.dump_after
         elif args.trace:
             x = target.trace()
 
@@ -178,17 +353,66 @@ def process_script(args, source, expected_result=None):
             pass
         else:
             print(x)
+        if args.timings:
+            print_timings(args, context.timings)
         return x
 
 
-def expected_result(args, source, result, checked, msg):
+def print_timings(args, timings):
+    if args.timings_json:
+        print(timings.json())
+    else:
+        print('\n'.join(timings.lines()))
+
 
-    def result_from_script(source):
-        source_lines = open(source).read()
-        code = compile(source_lines, '<string>', 'exec')
+WATCH_INTERVAL = 0.5
+
+
+def watch_script(args):
+    """
+    Process the script each time it, or one of the modules it imports, is
+    modified. The code of functions is kept between compilations, hence only
+    the functions modified since the previous compilation are compiled again.
+    """
+    fragments = dict()
+    mtimes = None
+    try:
+        while True:
+            try:
+                current = watched_mtimes(args.source)
+            except (IOError, OSError):
+                # file being saved
+                current = mtimes
+            if current != mtimes:
+                mtimes = current
+                print('-- %s %s' % (time.strftime('%H:%M:%S'), args.source))
+                try:
+                    process_script(args, args.source, fragments=fragments)
+                except Exception:
+                    traceback.print_exc()
+            time.sleep(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        return True
+
+
+def watched_mtimes(source):
+    # modification times of the script and of the modules it imports
+    with open(source) as f:
+        text = f.read()
+    directory = common.source_directory(source)
+    paths = [source] + [common.module_path(name, directory)
+                        for name, _ in common.module_sources(text, directory)]
+    return [os.path.getmtime(path) for path in paths]
+
+
+def expected_result(args, source, text, result, checked, msg):
+
+    def result_from_script(text):
+        # numsed builtins are not all python builtins
+        builtins = {name: getattr(numsed_lib, 'builtin_' + name) for name in numsed_lib.BUILTINS}
         try:
-            with common.ListStream() as x:
-                exec(code, {})
+            with common.ListStream() as x, common.ModulePath(common.source_directory(source)):
+                exec(text, builtins)
         except SystemExit:
             pass
         return x.singlestring()
@@ -198,7 +422,7 @@ def expected_result(args, source, result, checked, msg):
 
     if result is None:
         # no result in test suite, run script
-        return result_from_script(source)
+        return result_from_script(text)
     else:
         # result in test suite
         if result[0].startswith('numsed error') or result[0].startswith('SyntaxError:'):
@@ -206,29 +430,73 @@ def expected_result(args, source, result, checked, msg):
         elif args.opcode or args.sed:
             return result_from_suite()
         else:
-            return result_from_script(source)
+            return result_from_script(text)
 
 
-def test_script(args, source, result, checked, msg):
+def test_script(args, source, text, result, checked, msg, run_result=None, context=None):
     """
     if result is None, the test has to be compared with the python script
     if result is not None, the test has to be compared with this result
     checked and msg are the results of syntax checking
+    run_result is the output and run time of the script if already run
+    context is the compiler context, including the timing of checking
+
+    The timing and output of passing tests are cached. A test is run again
+    if it failed, if its text, its expected result, its options or the
+    compiler have changed, or with --force. Tests are always run with
+    --timings.
     """
     if not source.endswith('.py'):
         return False
 
+    if args.no_cache or args.timings:
+        return run_test(args, source, text, result, checked, msg, run_result, context)
+
+    cache = common.CompilationCache()
+    key = test_key(args, cache, source, text, result)
+    path = None if args.force else cache.lookup(key)
+    if path is None:
+        with common.ListStream() as x:
+            status, time_sed = run_test(args, source, text, result, checked, msg, run_result,
+                                        context)
+        if not status:
+            # failures are not cached, they are expected to be fixed
+            sys.stdout.write(x.singlestring())
+            return status, time_sed
+        lines = x.singlestring().split('\n')
+        path = cache.store(key, ['%d %f' % (status, time_sed)] + lines)
+
+    lines = list(common.read_lines(path))
+    status, time_sed = lines[0].split()
+    sys.stdout.write('\n'.join(lines[1:]))
+    return bool(int(status)), float(time_sed)
+
+
+def test_key(args, cache, source, text, result):
+    # the reference is made by running the script with the interpreter
+    context = compiler_context(args)
+    return cache.key('test', tuple(sys.version_info), sys.executable,
+                     numsed_conversion(args).__name__, transformation(args),
+                     [name for name in common.PASS_NAMES if context.runnable(name)],
+                     args.compact, text, result,
+                     common.module_sources(text, common.source_directory(source)))
+
+
+def run_test(args, source, text, result, checked, msg, run_result=None, context=None):
     # make reference by running original script or using result lines in suite
-    ref = expected_result(args, source, result, checked, msg)
+    ref = expected_result(args, source, text, result, checked, msg)
     print(ref)
 
     # run conversion or use result of syntax checking
     if checked is False:
         res = msg #+ '\n'
         time_sed = 0
+    elif run_result is not None:
+        res, time_sed = run_result
     else:
         conversion = numsed_conversion(args)
-        target = conversion(source, transformation(args))
+        target = conversion(source, transformation(args), context or compiler_context(args),
+                            text)
 
         # run conversion
         t0 = time.time()
@@ -238,39 +506,62 @@ def test_script(args, source, result, checked, msg):
             print(res)
 
     # compare
-    status, diff = common.list_compare('ref', 'res', ref.splitlines(), res.splitlines())
+    status, diff = common.list_compare('ref', 'res', comparable_lines(ref), comparable_lines(res))
     if not status:
         for _ in diff:
             print(_)
 
+    if args.timings and context is not None:
+        print_timings(args, context.timings)
+
     return status, time_sed
 
 
+def comparable_lines(output):
+    # the text of syntax errors depends on the python version, only the error
+    # and its line are compared
+    lines = output.splitlines()
+    if lines and lines[0].startswith('SyntaxError:'):
+        lines[0] = 'SyntaxError:'
+    return lines
+
+
 def tests_from_dir(source):
     for test in glob.glob(os.path.join(source, '*.py')):
-        print(test)
-        yield test, test, None
+        yield test, test, None, None
 
 
 def tests_from_suite(source):
+    # tests are compiled from their text, with the name of the suite
     for test, result in common.testlines(source):
-        print(test[0].rstrip())
-        with open(common.TMP_PY, 'w') as f:
-            f.writelines(test)
-        yield common.TMP_PY, test[0].rstrip(), result
+        yield source, test[0].rstrip(), result, ''.join(test)
+
+
+def process_test(args, title, test, result, text, run_result=None):
+    print(title)
+    return process_script(args, test, result, text, run_result=run_result)
 
 
 def process_tests(args, tests_from_source):
+    tests = list(tests_from_source(args.source))
+    durations = common.TestDurations('%s %s %s' % (os.path.abspath(args.source),
+                                                   numsed_conversion(args).__name__,
+                                                   transformation(args)))
+    run_results = single_sed_results(args, tests) if args.single_sed else dict()
+    tasks = [(text or test, (args, title, test, result, text, run_results.get(index)))
+             for index, (test, title, result, text) in enumerate(tests)]
+    results = run_tasks(args, process_test, tasks, durations)
     timing = []
     status = True
-    for test, title, result in tests_from_source(args.source):
-        r = process_script(args, test, result)
+    for (test, title, result, text), r in zip(tests, results):
         status = status and (not args.test or r)
         if args.test:
             timing.append((title, status[1]))
             status = status[0]
         if not status:
             break
+    results.close()
+    durations.save()
     if args.test:
         s = 0
         for (test, timing) in timing:
@@ -281,64 +572,172 @@ def process_tests(args, tests_from_source):
     return status
 
 
+def single_sed_results(args, tests):
+    """
+    Run the sed scripts of the tests in a single sed process, and return their
+    outputs and run times by index of test. The run time of the process is
+    shared equally between the tests. Tests rejected by the checker and tests
+    with cached results are not run.
+    """
+    cache = None if args.no_cache else common.CompilationCache()
+    indexes = []
+    opcodes = []
+    for index, (test, title, result, text) in enumerate(tests):
+        if not test.endswith('.py'):
+            continue
+        if text is None:
+            with open(test) as f:
+                text = f.read()
+        checked, msg = checker.check_text(text, common.source_directory(test),
+                                          literal=args.literal)
+        if checked is False:
+            continue
+        if cache and not args.force and cache.lookup(test_key(args, cache, test, text, result)):
+            continue
+        conversion = sedcode.SedConversion(test, transformation(args), compiler_context(args), text)
+        indexes.append(index)
+        opcodes.append(conversion.opcode)
+
+    if not opcodes:
+        return dict()
+
+    t0 = time.time()
+    outputs = sedcode.run_sed_batch(opcodes, compiler_context(args))
+    time_sed = (time.time() - t0) / len(opcodes)
+    return {index: (output, time_sed) for index, output in zip(indexes, outputs)}
+
+
 def process_batch(args):
-    status = True
     with open(args.source) as batch:
-        for line in batch:
-            if line.strip() and line[0] != ';':
-                testargs = line.strip()
+        lines = [line.strip() for line in batch if line.strip() and line[0] != ';']
 
-                # propagate parameter test directory
-                if args.batchdir:
-                    testargs += ' --batchdir %s' % args.batchdir
+    tasks = []
+    for line in lines:
+        testargs = line
 
-                status = numsed(testargs)
-                if not status:
-                    break
-    print('ALL TESTS OK' if status else 'ONE TEST FAILURE in ' + line.strip())
+        # propagate parameter test directory
+        if args.batchdir:
+            testargs += ' --batchdir %s' % args.batchdir
 
+        tasks.append((line, (testargs,)))
 
-def numsed(argstring=None):
+    durations = common.TestDurations(os.path.abspath(args.source))
+    results = run_tasks(args, numsed, tasks, durations)
+    status = True
+    for line, status in zip(lines, results):
+        if not status:
+            break
+    results.close()
+    durations.save()
+    print('ALL TESTS OK' if status else 'ONE TEST FAILURE in ' + line)
+
+
+def run_tasks(args, function, tasks, durations):
+    """
+    Yield the results of function called on each task, in the order of the
+    tasks. A task is a pair (text, arguments of function), text identifying
+    the task for recording its duration. With several jobs, tasks are run in
+    a process pool, longest first according to their last durations. The
+    output of each task is kept together, and printed in the order of the
+    tasks. Remaining tasks are cancelled when the iteration is stopped.
+    """
+    if args.jobs == 1:
+        for text, arguments in tasks:
+            t0 = time.time()
+            result = function(*arguments)
+            durations.record(text, time.time() - t0)
+            yield result
+        return
+
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        pending = dict()
+        for index in sorted(range(len(tasks)), key=lambda i: -durations.duration(tasks[i][0])):
+            pending[index] = pool.apply_async(captured_call, (function, tasks[index][1]))
+        for index, (text, _) in enumerate(tasks):
+            output, result, duration = pending[index].get()
+            sys.stdout.write(output)
+            durations.record(text, duration)
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def captured_call(function, arguments):
+    # run in a pool process, output is returned with the result
+    t0 = time.time()
+    with common.ListStream() as x:
+        result = function(*arguments)
+    return x.singlestring(), result, time.time() - t0
+
+
+def numsed(argstring=None, fragments=None):
 
     parser, args = parse_command_line(argstring)
+
     if args.help:
         parser.print_help()
 
+    elif args.passes:
+        print(common.list_passes(compiler_context(args)))
+
     elif args.fullhelp:
         do_fullhelp()
 
+    elif args.serve:
+        return daemon.serve(args.socket or daemon.socket_path(), numsed,
+                            (sedcode.templates, sedcode.fragments))
+
     elif args.batch:
         process_batch(args)
 
     elif args.snippets:
         return snippet_test.main()
 
+    elif args.profile_compiler:
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(process_source, args, fragments)
+        finally:
+            profiler.dump_stats(args.profile_compiler)
+
+    elif args.timings:
+        with common.MemoryTracing():
+            return process_source(args, fragments)
+
     else:
-        if os.path.isdir(args.source):
-            result = process_tests(args, tests_from_dir)
-        elif os.path.isfile(args.source):
-            if args.source.endswith('.suite.py'):
-                result = process_tests(args, tests_from_suite)
-            elif args.source.endswith('.py'):
-                result = process_script(args, args.source)
-            elif args.source.endswith('.opc'):
-                if args.run:
-                    opcode = open(args.source).readlines()
-                    opcode = [_.rstrip() for _ in opcode]
-                    result = opcoder.interpreter(opcode)
-                else:
-                    pass
+        return process_source(args, fragments)
+
+
+def process_source(args, fragments=None):
+    if os.path.isdir(args.source):
+        result = process_tests(args, tests_from_dir)
+    elif os.path.isfile(args.source):
+        if args.source.endswith('.suite.py'):
+            result = process_tests(args, tests_from_suite)
+        elif args.source.endswith('.py') and args.watch:
+            result = watch_script(args)
+        elif args.source.endswith('.py'):
+            result = process_script(args, args.source, fragments=fragments)
+        elif args.source.endswith('.opc'):
+            if args.run:
+                with open(args.source) as f:
+                    opcode = opcoder.parse_code(f.readlines())
+                result = opcoder.interpreter(opcode)
             else:
-                print('numsed error: file type not handled:', args.source)
-                return ''
+                pass
         else:
-            print('numsed error: file not found:', args.source)
+            print('numsed error: file type not handled:', args.source)
             return ''
+    else:
+        print('numsed error: file not found:', args.source)
+        return ''
 
-        if args.coverage:
-            opcoder.display_coverage()
+    if args.coverage:
+        opcoder.display_coverage()
 
-        return result
+    return result
 
 
 def numsed_main():
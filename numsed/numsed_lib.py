@@ -1,7 +1,7 @@
 """
 numsed library
 
-numsed opcodes include unsigned operators (+, -, *) and unsigned
+numsed opcodes include unsigned operators (+, -, *, **) and unsigned
 comparisons. This library provides functions implementing all
 arithmetic and comparison signed operators using only numsed
 operators.
@@ -145,13 +145,14 @@ def umod(a, b):
     return r
 
 
-def upow(base, exp):
-    result = 1
+def upowmod(base, exp, mod):
+    result = umod(1, mod)
+    base = umod(base, mod)
     while exp:
         if is_odd(exp):
-            result *= base
+            result = umod(result * base, mod)
         exp = divide_by_two(exp)
-        base *= base
+        base = umod(base * base, mod)
     return result
 
 
@@ -284,12 +285,29 @@ def signed_pow(base, exp):
         exit()
 
     if is_positive(base):
-        return upow(base, exp)
+        return base ** exp
     else:
-        r = upow(-base, exp)
+        r = (-base) ** exp
         return -r if is_odd(exp) else r
 
 
+def signed_powmod(base, exp, mod):
+    if not is_positive(exp):
+        print('numsed error: Exponent should be positive: ', exp)
+        exit()
+    abs_mod = abs(mod)
+    if abs_mod == 0:
+        print('numsed error: pow() 3rd argument cannot be 0')
+        exit()
+
+    r = upowmod(signed_mod(base, abs_mod), exp, abs_mod)
+
+    if is_positive(mod):
+        return r
+    else:
+        return 0 if r == 0 else -(abs_mod - r)
+
+
 # -- Primitives --------------------------------------------------------------
 
 """
@@ -299,13 +317,29 @@ However, they are handled separately:
 - they are added to positive forms. This enables to test the transformation,
 - they are removed when generating opcodes and replaced with dedicated
   opcodes.
-Note that current implementation imposes that there is no call of any function
-as an argument of a primitive function and there is no control to check that.
+Builtin functions are primitives which may also be called from numsed scripts.
+They handle signed integers. Their definitions are prefixed with builtin_ so
+that they do not hide python builtins, and so that scripts may define
+functions or variables with the names of the builtins, hiding them as in
+python. The calls of builtins in scripts are renamed when preparing the
+script.
+Division and modulo by a positive constant are replaced with primitives. The
+constant divisor becomes the argument of their opcodes.
 """
 
 
+# names of builtins in scripts and their definitions
+BUILTINS = ('isqrt', 'gcd', 'min', 'max', 'ndigits')
+BUILTIN_FUNCTIONS = tuple('builtin_' + name for name in BUILTINS)
+
+CONSTANT_DIVISIONS = ('divide_by_constant', 'modulo_constant',
+                      'divmod_constant')
+
 PRIMITIVES = ('is_positive', 'abs', 'is_odd', 'divide_by_two',
-              'divide_by_ten', 'modulo_ten', 'divmod10')
+              'divide_by_ten', 'modulo_ten', 'divmod10') + BUILTIN_FUNCTIONS + \
+             CONSTANT_DIVISIONS
+
+SIGNED_PRIMITIVES = ('is_positive', 'abs') + BUILTIN_FUNCTIONS + CONSTANT_DIVISIONS
 
 
 def is_positive(x):
@@ -328,3 +362,42 @@ def modulo_ten(x):
 
 def divmod10(x):
     return x // 10, x % 10
+
+def divide_by_constant(x, k):
+    return x // k
+
+def modulo_constant(x, k):
+    return x % k
+
+def divmod_constant(x, k):
+    return x // k, x % k
+
+
+# builtin functions
+
+
+def builtin_isqrt(x):
+    if x < 0:
+        raise ValueError('isqrt() argument must be nonnegative')
+    r = x
+    y = (r + 1) // 2
+    while y < r:
+        r = y
+        y = (r + x // r) // 2
+    return r
+
+def builtin_gcd(x, y):
+    x = abs(x)
+    y = abs(y)
+    while y:
+        x, y = y, x % y
+    return x
+
+def builtin_min(x, y):
+    return x if x <= y else y
+
+def builtin_max(x, y):
+    return x if x >= y else y
+
+def builtin_ndigits(x):
+    return len(str(abs(x)))
@@ -6,7 +6,10 @@ from __future__ import print_function
 
 import sys
 import re
+import ast
+import inspect
 import dis
+import numbers
 import types
 
 try:
@@ -20,12 +23,12 @@ except:
 
 
 OPCODES = ('LOAD_CONST', 'LOAD_NAME', 'LOAD_GLOBAL', 'STORE_NAME', 'STORE_GLOBAL',
-           'LOAD_FAST', 'STORE_FAST',
+           'LOAD_FAST', 'STORE_FAST', 'DELETE_NAME',
            'POP_TOP', 'DUP_TOP', 'ROT_TWO', 'ROT_THREE',
            'BUILD_TUPLE', 'UNPACK_SEQUENCE',
            'UNARY_NEGATIVE', 'UNARY_POSITIVE',
            'BINARY_ADD', 'BINARY_SUBTRACT', 'BINARY_MULTIPLY',
-           'BINARY_FLOOR_DIVIDE', 'BINARY_MODULO', 'BINARY_POWER',
+           'BINARY_FLOOR_DIVIDE', 'BINARY_MODULO', 'BINARY_POWER', 'DIVMOD',
            'COMPARE_OP', 'UNARY_NOT',
            'JUMP', 'POP_JUMP_IF_TRUE', 'POP_JUMP_IF_FALSE',
            'JUMP_IF_TRUE_OR_POP', 'JUMP_IF_FALSE_OR_POP',
@@ -35,17 +38,87 @@ OPCODES = ('LOAD_CONST', 'LOAD_NAME', 'LOAD_GLOBAL', 'STORE_NAME', 'STORE_GLOBAL
            'STARTUP', 'MAKE_CONTEXT', 'POP_CONTEXT',
            'IS_POSITIVE', 'ABS', 'IS_ODD',
            'DIVIDE_BY_TWO', 'DIVIDE_BY_TEN', 'MODULO_TEN', 'DIVMOD10',
+           'ISQRT', 'GCD', 'MIN', 'MAX', 'NDIGITS',
+           'DIVIDE_BY_CONSTANT', 'MODULO_CONSTANT', 'DIVMOD_CONSTANT',
            'TRACE', 'EXIT')
 
 
+# -- Instructions ------------------------------------------------------------
+
+
+class Instruction(object):
+    """
+    Numsed instruction: an opcode with an optional argument, or a label. The
+    source line is the line of the python script the instruction comes from.
+    Instructions are converted to text only for tracing.
+    """
+    __slots__ = ('opcode', 'arg', 'label', 'line')
+
+    def __init__(self, opcode=None, arg=None, label=None, line=None):
+        self.opcode = opcode
+        self.arg = arg
+        self.label = label
+        self.line = line
+
+    @classmethod
+    def parse(cls, text):
+        text = text.strip()
+        if text.startswith(':'):
+            return cls(label=text[1:])
+        else:
+            opcode, arg = scancode(text)
+            return cls(opcode, arg)
+
+    def is_label(self):
+        return self.label is not None
+
+    def is_function_label(self):
+        return self.label is not None and is_function_label(':' + self.label)
+
+    def __str__(self):
+        if self.label is not None:
+            return ':' + self.label
+        elif self.arg is None:
+            return self.opcode
+        else:
+            return '%-17s %s' % (self.opcode, self.arg)
+
+
+def scancode(instr):
+    x = instr.split(None, 1)
+    opc = x[0]
+    arg = x[1] if len(x) > 1 else None
+    return opc, arg
+
+
+def parse_code(lines):
+    """
+    Convert opcodes given as text into instructions. Empty lines are ignored.
+    """
+    return [Instruction.parse(x) for x in lines if x.strip()]
+
+
+def format_code(code):
+    """
+    Convert instructions into text, labels being preceded by an empty line.
+    """
+    lines = []
+    for instr in code:
+        if instr.is_label():
+            lines.append('')
+        lines.append(str(instr))
+    return lines
+
+
 # -- Disassembly -------------------------------------------------------------
 
 
 class DisassemblyConversion(common.NumsedConversion):
-    def __init__(self, source, transformation):
-        common.NumsedConversion.__init__(self, source, transformation)
-        ast_trans = transformer.AstConversion(source, transformation)
-        self.code = disassemble(ast_trans.tree)
+    def __init__(self, source, transformation, context=None, text=None):
+        common.NumsedConversion.__init__(self, source, transformation, context, text)
+        ast_trans = transformer.AstConversion(source, transformation, self.context, self.text)
+        with self.context.timings.phase('dis'):
+            self.code = disassemble(ast_trans.tree)
 
     def trace(self):
         return '\n'.join(self.code)
@@ -83,295 +156,970 @@ def is_function_label(x):
     return re.match(r':\w+\.func', x)
 
 
-# -- Preparing dis code ------------------------------------------------------
+# -- Numsed opcodes ----------------------------------------------------------
+
+
+class OpcodeConversion(common.NumsedConversion):
+    def __init__(self, source, transformation, context=None, text=None):
+        common.NumsedConversion.__init__(self, source, transformation, context, text)
+        if source.endswith('.opc'):
+            self.opcode = parse_code(self.text.splitlines())
+        elif self.context.cache is None:
+            self.opcode = self.compile()
+        else:
+            lines = self.cached_lines('opcode', lambda: format_code(self.compile()))
+            self.opcode = parse_code(lines)
+
+    def compile(self):
+        x = transformer.AstConversion(self.source, self.transformation, self.context, self.text)
+        load_modules(x.tree, self.directory(), self.transformation, self.context)
+        return opcodes(x.tree, self.context)
+
+    def trace(self):
+        return '\n'.join(format_code(self.opcode))
+
+    def run(self):
+        with common.ListStream() as x:
+            interpreter(self.opcode, coverage=False)
+        return x.singlestring()
+
+    def coverage(self):
+        return'\n'.join(interpreter(self.opcode, coverage=True))
+
+
+def opcodes(tree, context):
+    # run passes and return list of instructions
+    return OPCODE_PASSES.run(tree, context, context)
+
+
+def add_declarations(code, context):
+    newcode = []
+    newcode.append(Instruction('STARTUP'))
+
+    # add print declaration
+    newcode.extend(parse_code(PRINT_DECL()))
+
+    if divmod_required(code):
+        newcode.extend(parse_code(DIVMOD_DECL()))
+
+    if exit_required(code):
+        newcode.extend(parse_code(EXIT_DECL()))
+
+    newcode.extend(code)
+    return newcode
+
+
+def add_definitions(code, context):
+    # add print definition
+    code.extend(parse_code(PRINT()))
+
+    # add definitions of declared functions
+    for label, definition in (('divmod', DIVMOD_DEF),
+                              ('exit.func', EXIT_DEF)):
+        if is_declared(code, label):
+            code.extend(parse_code(definition()))
+    return code
+
+
+def is_declared(code, label):
+    for instr, next_instr in zip(code, code[1:]):
+        if (instr.opcode == 'LOAD_CONST' and instr.arg == label and
+                next_instr.opcode == 'MAKE_FUNCTION'):
+            return True
+    else:
+        return False
+
+
+# -- Code generation ---------------------------------------------------------
+
+
+BINARY_OPCODE = {
+    ast.Add: 'BINARY_ADD',
+    ast.Sub: 'BINARY_SUBTRACT',
+    ast.Mult: 'BINARY_MULTIPLY',
+    ast.FloorDiv: 'BINARY_FLOOR_DIVIDE',
+    ast.Mod: 'BINARY_MODULO',
+    ast.Pow: 'BINARY_POWER'}
 
+UNARY_OPCODE = {
+    ast.UAdd: 'UNARY_POSITIVE',
+    ast.USub: 'UNARY_NEGATIVE',
+    ast.Not: 'UNARY_NOT'}
 
-def prepared_dis_code(dis_code):
+COMPARE_OPERATOR = {
+    ast.Eq: '==',
+    ast.NotEq: '!=',
+    ast.Lt: '<',
+    ast.LtE: '<=',
+    ast.Gt: '>',
+    ast.GtE: '>='}
+
+
+def generate_code(tree, context):
     """
-    Keep only required labels.
-    Put labels on their own lines.
-    Remove relative jumps and keep explicit labels.
-    Keep only explicit arguments.
-    Replace reference to function objects by labels.
+    Generate opcodes from the AST of the transformed script. The code of the
+    script is followed by the code of the functions and by the code of the
+    imported modules. Primitives are not defined and their calls are replaced
+    with their opcodes.
     """
-    newcode = []
-    for line in dis_code.splitlines():
-        if line.strip():
-            label, instr, arg = parse_dis_instruction(line)
-            if label:
-                newcode.append(':%s' % label)
-            if arg:
-                newcode.append('%s %s' % (instr, arg))
+    generator = CodeGenerator(context.modules, context.fragments)
+    return generator.generate(tree)
+
+
+class CodeGenerator(ast.NodeVisitor):
+    """
+    Names are loaded and stored as in CPython: LOAD_NAME and STORE_NAME in
+    the script, LOAD_FAST and STORE_FAST for local variables of functions,
+    LOAD_GLOBAL and STORE_GLOBAL for other names in functions. Labels are
+    numbers unique in the whole program. Loops keep the labels of their
+    beginning and end, so break and continue are jumps to these labels.
+    """
+
+    def __init__(self, modules=None, fragments=None):
+        self.code = []
+        self.functions = []
+        self.modules = modules      # compiled modules by name
+        self.fragments = fragments  # code of functions by definition
+        self.declared = set()       # names of declared functions
+        self.linked = []            # imported modules, linked after functions
+        self.local_names = None     # None when generating script code
+        self.global_names = None
+        self.loops = []             # (continue label, break label)
+        self.label_counter = 0
+        self.line = None
+
+    def generate(self, tree):
+        self.statements(tree.body)
+        self.emit('EXIT')
+        for func in self.functions:
+            self.function(func)
+        for module in self.linked:
+            self.link(module.code, module.nlabels)
+        return self.code
+
+    def emit(self, opcode, arg=None):
+        arg = None if arg is None else str(arg)
+        self.code.append(Instruction(opcode, arg, line=self.line))
+
+    def new_label(self):
+        self.label_counter += 1
+        return '%d' % self.label_counter
+
+    def place_label(self, label):
+        self.code.append(Instruction(label=label, line=self.line))
+
+    def visit(self, node):
+        self.line = getattr(node, 'lineno', self.line)
+        return ast.NodeVisitor.visit(self, node)
+
+    def generic_visit(self, node):
+        raise Exception('Construct not handled: %s' % type(node).__name__)
+
+    # names
+
+    def load(self, name):
+        if self.local_names is None:
+            self.emit('LOAD_NAME', name)
+        elif name in self.local_names:
+            self.emit('LOAD_FAST', name)
+        else:
+            self.emit('LOAD_GLOBAL', name)
+
+    def store(self, name):
+        if self.local_names is None:
+            self.emit('STORE_NAME', name)
+        elif name in self.global_names:
+            self.emit('STORE_GLOBAL', name)
+        else:
+            self.emit('STORE_FAST', name)
+
+    # functions
+
+    def function(self, node):
+        if is_library_function(node.name):
+            self.link(*library_function_code(node))
+        else:
+            self.link(*self.script_function_code(node))
+
+    def link(self, code, nlabels):
+        """
+        Append the code of a function generated separately, its labels being
+        numbered from 1. Labels are relocated after the labels of the program.
+        """
+        offset = self.label_counter
+        for instr in code:
+            if instr.is_label():
+                instr = Instruction(label=relocate_label(instr.label, offset), line=instr.line)
+            elif instr.opcode in LABEL_OPCODES:
+                instr = Instruction(instr.opcode, relocate_label(instr.arg, offset), line=instr.line)
             else:
-                newcode.append(instr)
-    return newcode
+                instr = Instruction(instr.opcode, instr.arg, line=instr.line)
+            self.code.append(instr)
+        self.label_counter += nlabels
+
+    def script_function_code(self, node):
+        """
+        Return the code of a function of the script and the number of its
+        labels. The code is generated separately from the rest of the program
+        and is kept in fragments, so a function is compiled again only when its
+        definition is modified.
+        """
+        key = ('opcode', ast.dump(node))
+        if key not in self.fragments:
+            generator = CodeGenerator()
+            generator.function_code(node)
+            self.fragments[key] = (generator.code, generator.label_counter)
+        return self.fragments[key]
+
+    def function_code(self, node):
+        self.local_names, self.global_names = function_scope(node)
+        self.line = node.lineno
+        self.place_label(make_function_label(node.name))
+        self.emit('MAKE_CONTEXT')
+        # arguments are pushed first one first and popped in reverse order
+        for arg in reversed(function_arguments(node)):
+            self.emit('STORE_FAST', arg)
+        self.statements(node.body)
+        if falls_through(node.body):
+            self.emit('LOAD_CONST', 'None')
+            self.emit('POP_CONTEXT')
+            self.emit('RETURN_VALUE')
+
+    # statements
+
+    def statements(self, body):
+        for stmt in body:
+            self.visit(stmt)
+
+    def visit_ImportFrom(self, node):
+        # print_function is ignored
+        if node.module != '__future__':
+            self.import_module(node.module)
+
+    def import_module(self, name):
+        """
+        Declare all functions of a module and the library functions it
+        requires, and link its code. The modules imported by the module are
+        imported first.
+        """
+        module = self.modules[name]
+        if module in self.linked:
+            return
+        for name in module.modules:
+            self.import_module(name)
+        for name in module.library:
+            if name not in self.declared:
+                self.visit_FunctionDef(transformer.getfuncast(name).body[0])
+        for name in module.functions:
+            self.declare(name)
+        self.linked.append(module)
+
+    def visit_FunctionDef(self, node):
+        if node.name not in numsed_lib.PRIMITIVES:
+            self.declare(node.name)
+            self.functions.append(node)
+
+    def declare(self, name):
+        self.emit('LOAD_CONST', make_function_label(name))
+        self.emit('MAKE_FUNCTION', 0)
+        self.store(name)
+        self.declared.add(name)
+
+    def visit_Assign(self, node):
+        targets, value = node.targets, node.value
+        if (len(targets) == 1 and isinstance(targets[0], ast.Tuple) and
+                isinstance(value, ast.Tuple) and len(value.elts) in (1, 2, 3)):
+            # swap values on stack rather than building a tuple
+            for elt in value.elts:
+                self.visit(elt)
+            if len(value.elts) == 3:
+                self.emit('ROT_THREE')
+            if len(value.elts) > 1:
+                self.emit('ROT_TWO')
+            for elt in targets[0].elts:
+                self.store(elt.id)
+        else:
+            self.visit(value)
+            for index, target in enumerate(targets):
+                if index < len(targets) - 1:
+                    self.emit('DUP_TOP')
+                if isinstance(target, ast.Tuple):
+                    self.emit('UNPACK_SEQUENCE', len(target.elts))
+                    for elt in target.elts:
+                        self.store(elt.id)
+                else:
+                    self.store(target.id)
 
+    def visit_AugAssign(self, node):
+        self.load(node.target.id)
+        self.visit(node.value)
+        self.emit(BINARY_OPCODE[type(node.op)])
+        self.store(node.target.id)
 
-def parse_dis_instruction(s):
-    #  45 BINARY_MULTIPLY
-    #  59 JUMP_ABSOLUTE           27
-    #  46 STORE_FAST               5 (aux)
-    m = re.search(r'(\d+) (\w+) *(.*)', s)
-    label, instr, arg = m.group(1), m.group(2), m.group(3)
-
-    if '>>' not in s:
-        label = None
-
-    if not arg:
-        arg = None
-    elif 'code object' in arg:
-        m = re.search(r'code object (\w+)', arg)
-        arg = make_function_label(m.group(1))
-    elif instr == 'CALL_FUNCTION':
-        # keep number of arguments, remove parentheses if any
-        arg = re.sub(r'\(.*\)', '', arg)
-        arg = arg.strip()
-    elif '(' in arg:
-        # if parentheses, content is used as argument
-        # if any quotes, they are kept
-        m = re.search(r'\((.*)\) *$', arg)
-        arg = m.group(1)
-        if arg.startswith('to '):
-            arg = arg[3:]
+    def visit_Expr(self, node):
+        if is_constant(node.value):
+            # docstrings and other constant expressions
+            pass
         else:
-            m = re.search(r'\((.*)\) *$', arg)
-            if m:
-                # tuples
-                arg = m.group(1).replace(' ', '')
-                if arg[-1] == ',':
-                    arg = arg[:-1]
-    else:
-        arg = arg.strip()
+            self.visit(node.value)
+            self.emit('POP_TOP')
+
+    def visit_If(self, node):
+        end = self.new_label()
+        orelse = self.new_label() if node.orelse else end
+        self.jump_if(node.test, False, orelse)
+        self.statements(node.body)
+        if node.orelse:
+            if falls_through(node.body):
+                self.emit('JUMP', end)
+            self.place_label(orelse)
+            self.statements(node.orelse)
+        self.place_label(end)
+
+    def visit_While(self, node):
+        start = self.new_label()
+        end = self.new_label()
+        orelse = self.new_label() if node.orelse else end
+        self.place_label(start)
+        self.jump_if(node.test, False, orelse)
+        self.loops.append((start, end))
+        self.statements(node.body)
+        self.loops.pop()
+        if falls_through(node.body):
+            self.emit('JUMP', start)
+        if node.orelse:
+            self.place_label(orelse)
+            self.statements(node.orelse)
+        self.place_label(end)
+
+    def visit_Break(self, node):
+        self.emit('JUMP', self.loops[-1][1])
+
+    def visit_Continue(self, node):
+        self.emit('JUMP', self.loops[-1][0])
+
+    def visit_Return(self, node):
+        if node.value is None:
+            self.emit('LOAD_CONST', 'None')
+        else:
+            self.visit(node.value)
+        self.emit('POP_CONTEXT')
+        self.emit('RETURN_VALUE')
 
-    return label, instr, arg
+    def visit_Pass(self, node):
+        pass
 
+    def visit_Global(self, node):
+        # handled by function_scope
+        pass
 
-# -- Disassemble to numsed opcodes -------------------------------------------
+    # expressions
 
+    def visit_Constant(self, node):
+        self.emit('LOAD_CONST', constant_arg(constant_value(node)))
 
-class OpcodeConversion(common.NumsedConversion):
-    def __init__(self, source, transformation):
-        common.NumsedConversion.__init__(self, source, transformation)
-        if source.endswith('.py'):
-            x = DisassemblyConversion(source, transformation)
-            dis_code = x.trace()
-            self.opcode = opcodes(dis_code)
-        elif source.endswith('.opc'):
-            with open(source) as f:
-                self.opcode = [_.rstrip() for _ in f.readlines()]
+    visit_Num = visit_Str = visit_NameConstant = visit_Constant
+
+    def visit_Name(self, node):
+        if node.id == 'None':
+            # python2
+            self.emit('LOAD_CONST', 'None')
         else:
-            raise Exception('Invalid file type')
+            self.load(node.id)
 
-    def trace(self):
-        return '\n'.join(self.opcode)
+    def visit_Tuple(self, node):
+        for elt in node.elts:
+            self.visit(elt)
+        self.emit('BUILD_TUPLE', len(node.elts))
 
-    def run(self):
-        with common.ListStream() as x:
-            interpreter(self.opcode, coverage=False)
-        return x.singlestring()
+    def visit_UnaryOp(self, node):
+        value = folded_constant(node)
+        if value is not None:
+            self.emit('LOAD_CONST', value)
+        else:
+            self.visit(node.operand)
+            self.emit(UNARY_OPCODE[type(node.op)])
 
-    def coverage(self):
-        return'\n'.join(interpreter(self.opcode, coverage=True))
+    def visit_BinOp(self, node):
+        value = folded_constant(node)
+        if value is not None:
+            self.emit('LOAD_CONST', value)
+        else:
+            self.visit(node.left)
+            self.visit(node.right)
+            self.emit(BINARY_OPCODE[type(node.op)])
+
+    def visit_Compare(self, node):
+        # len(node.ops) == 1 ensured by PrepareTransformer
+        self.visit(node.left)
+        self.visit(node.comparators[0])
+        self.emit('COMPARE_OP', COMPARE_OPERATOR[type(node.ops[0])])
+
+    def visit_BoolOp(self, node):
+        if isinstance(node.op, ast.And):
+            opcode = 'JUMP_IF_FALSE_OR_POP'
+        else:
+            opcode = 'JUMP_IF_TRUE_OR_POP'
+        end = self.new_label()
+        for value in node.values[:-1]:
+            self.visit(value)
+            self.emit(opcode, end)
+        self.visit(node.values[-1])
+        self.place_label(end)
+
+    def visit_IfExp(self, node):
+        orelse = self.new_label()
+        end = self.new_label()
+        self.jump_if(node.test, False, orelse)
+        self.visit(node.body)
+        self.emit('JUMP', end)
+        self.place_label(orelse)
+        self.visit(node.orelse)
+        self.place_label(end)
+
+    def visit_Call(self, node):
+        func = node.func.id
+        if func in numsed_lib.CONSTANT_DIVISIONS:
+            # the constant divisor is the argument of the opcode
+            self.visit(node.args[0])
+            self.emit(primitive_opcode(func), constant_value(node.args[1]))
+        elif func in numsed_lib.PRIMITIVES:
+            for arg in node.args:
+                self.visit(arg)
+            self.emit(primitive_opcode(func))
+        else:
+            self.load(func)
+            for arg in node.args:
+                self.visit(arg)
+            self.emit('CALL_FUNCTION', len(node.args))
+
+    def jump_if(self, node, condition, label):
+        """
+        Jump to label if the truth value of node is condition. Boolean
+        operators are compiled into jumps, values are not pushed.
+        """
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            self.jump_if(node.operand, not condition, label)
+        elif isinstance(node, ast.BoolOp):
+            if isinstance(node.op, ast.And) != condition:
+                # and jumping if false, or jumping if true
+                for value in node.values:
+                    self.jump_if(value, condition, label)
+            else:
+                next_label = self.new_label()
+                for value in node.values[:-1]:
+                    self.jump_if(value, not condition, next_label)
+                self.jump_if(node.values[-1], condition, label)
+                self.place_label(next_label)
+        else:
+            self.visit(node)
+            self.emit('POP_JUMP_IF_TRUE' if condition else 'POP_JUMP_IF_FALSE', label)
 
 
-def scancodes(code):
-    for instr in code:
-        opc, arg = scancode(instr)
-        yield instr, opc, arg
+# opcodes with a label as argument
+LABEL_OPCODES = ('JUMP', 'POP_JUMP_IF_TRUE', 'POP_JUMP_IF_FALSE',
+                 'JUMP_IF_TRUE_OR_POP', 'JUMP_IF_FALSE_OR_POP', 'SETUP_LOOP')
 
+# code of library functions and number of their labels by function name
+library_code = dict()
 
-def scancode(instr):
-    x = instr.split(None, 1)
-    opc = x[0]
-    arg = x[1] if len(x) > 1 else None
-    return opc, arg
 
+def is_library_function(name):
+    # library functions may not be redefined in scripts (tested by checker)
+    return inspect.isfunction(getattr(numsed_lib, name, None))
 
-def opcodes(dis_code):
-    # simplify dis code
-    dis_code = prepared_dis_code(dis_code)
 
-    newcode = []
-    newcode.append('STARTUP')
+def library_function_code(node):
+    """
+    Return the code of a library function and the number of its labels. The
+    code of library functions does not depend on the script, it is generated
+    once and linked in each program calling the function.
+    """
+    if node.name not in library_code:
+        generator = CodeGenerator()
+        generator.function_code(node)
+        library_code[node.name] = (generator.code, generator.label_counter)
+    return library_code[node.name]
 
-    # add print declaration
-    newcode.extend(PRINT_DECL())
-
-    if divmod_required(dis_code):
-        newcode.extend(DIVMOD_DECL())
-
-    if exit_required(dis_code):
-        newcode.extend(EXIT_DECL())
-
-    # normalize disassembly labels and opcode arguments
-    newcode.extend(dis_code)
-
-    # handle script termination
-    replace_script_return_with_exit(newcode)
-
-    # inline helper functions (is_positive, negative, divide_by_ten)
-    newcode = inline_helper_opcodes(newcode)
-
-    # handle function arguments and context
-    tmp = []
-    for instr, opc, args in scancodes(newcode):
-        if opc == 'FUNCTION':
-            x = args.split()
-            name = x[0]
-            args = x[1:]
-            tmp.append(':%s' % name)
-            tmp.append('MAKE_CONTEXT')
-            # arguments are pushed first one first by native python compiler,
-            # and they have to be popped in reverse order
-            for arg in reversed(args):
-                tmp.append('STORE_FAST %s' % arg)
-        elif opc == 'RETURN_VALUE':
-            tmp.append('POP_CONTEXT')
-            tmp.append(instr)
+
+def relocate_label(label, offset):
+    if label.isdigit():
+        return '%d' % (int(label) + offset)
+    else:
+        return label
+
+
+# -- Modules -----------------------------------------------------------------
+
+
+class ModuleObject(object):
+    """
+    Compiled module: names of the functions defined in the module, of the
+    library functions and of the modules it requires, code of its functions
+    and number of labels in code. Labels are numbered from 1 and are
+    relocated when linking the module in a program.
+    """
+    def __init__(self, functions, library, modules, code, nlabels):
+        self.functions = functions
+        self.library = library
+        self.modules = modules
+        self.code = code
+        self.nlabels = nlabels
+
+    def lines(self):
+        return (['# functions %s' % ' '.join(self.functions),
+                 '# library %s' % ' '.join(self.library),
+                 '# modules %s' % ' '.join(self.modules),
+                 '# labels %d' % self.nlabels] +
+                format_code(self.code))
+
+    @classmethod
+    def parse(cls, lines):
+        functions, library, modules, (nlabels,) = [line.split()[2:] for line in lines[:4]]
+        return cls(functions, library, modules, parse_code(lines[4:]), int(nlabels))
+
+
+class ModuleConversion(common.NumsedConversion):
+    """
+    Compile a module independently of the scripts importing it. Compiled
+    modules are cached as other conversions, hence a module is compiled again
+    only when its source changes.
+    """
+    def __init__(self, source, transformation, context=None, text=None):
+        common.NumsedConversion.__init__(self, source, transformation, context, text)
+        if self.context.cache is None:
+            self.module = self.compile()
         else:
-            tmp.append(instr)
-    newcode = tmp
-
-    # rename jump opcodes
-    for index, (instr, opc, arg) in enumerate(scancodes(newcode)):
-        if opc in ('JUMP_ABSOLUTE', 'JUMP_FORWARD'):
-            newcode[index] = 'JUMP ' + arg
-
-    # link
-    link_opcode(newcode)
-
-    # replace INPLACE_* with BINARY_ equivalent
-    for index, instr in enumerate(newcode):
-        newcode[index] = re.sub('^INPLACE_', 'BINARY_', instr)
-
-    # clean long int representation (python2)
-    for index, instr in enumerate(newcode):
-        if re.match(r'LOAD_CONST +\d+L', instr):
-            newcode[index] = instr[:-1]
-
-    # handle break: find associated start of loop, retrieve label of end of loop
-    # and replace break with jump to end of loop
-    for index, instr in enumerate(newcode):
-        if instr == 'BREAK_LOOP':
-            setup_loop = newcode[current_loop(newcode, index)]
-            endblock_label = setup_loop.split(None, 1)[1]
-            newcode[index] = 'JUMP ' + endblock_label
-
-    # remove some opcodes
-    tmp = []
-    for index, (instr, opc, arg) in enumerate(scancodes(newcode)):
-        if opc == 'EXTENDED_ARG':
-            # used in py3 for comparison operators, useless here, operators
-            # have been written in argument position
-            pass
-        elif (opc == 'LOAD_CONST' and re.match(r"^'.*'$", arg) and
-              scancode(newcode[index + 1])[0] == 'MAKE_FUNCTION'):
-            # use in py3, the name of a function is pushed before MAKE_FUNCTION
-            # keep other strings
-            pass
-        elif opc == 'STORE_NAME' and arg in numsed_lib.PRIMITIVES:
-            # use in py3
-            pass
+            lines = list(self.cached_lines('module', lambda: self.compile().lines()))
+            self.module = ModuleObject.parse(lines)
+
+    def compile(self):
+        # passes are configured as for the importing script
+        context = common.CompilerContext(self.context.level,
+                                         self.context.enabled,
+                                         self.context.disabled)
+        x = transformer.AstConversion(self.source, self.transformation, context, self.text)
+        generator = CodeGenerator()
+        functions, library, modules = [], [], []
+        for node in x.tree.body:
+            if isinstance(node, ast.ImportFrom):
+                if node.module != '__future__':
+                    modules.append(node.module)
+            elif node.name in numsed_lib.PRIMITIVES:
+                pass
+            elif is_library_function(node.name):
+                library.append(node.name)
+            else:
+                functions.append(node.name)
+                generator.function_code(node)
+        return ModuleObject(functions, library, modules, generator.code,
+                            generator.label_counter)
+
+
+def load_modules(tree, directory, transformation, context):
+    """
+    Compile the modules imported by a script, directly or not, and store them
+    by name in context.
+    """
+    names = [node.module for node in tree.body
+             if isinstance(node, ast.ImportFrom) and node.module != '__future__']
+    while names:
+        name = names.pop()
+        if name not in context.modules:
+            path = common.module_path(name, directory)
+            module = ModuleConversion(path, transformation, context).module
+            context.modules[name] = module
+            names.extend(module.modules)
+
+
+def function_arguments(node):
+    # arguments are Name nodes in python2 and arg nodes in python3
+    return [getattr(arg, 'arg', None) or arg.id for arg in node.args.args]
+
+
+def function_scope(node):
+    """
+    Return local and global names of a function. Arguments and assigned
+    names are local unless declared global.
+    """
+    local_names = set(function_arguments(node))
+    global_names = set()
+    for x in ast.walk(node):
+        if isinstance(x, ast.Global):
+            global_names.update(x.names)
+        elif isinstance(x, ast.Name) and isinstance(x.ctx, ast.Store):
+            local_names.add(x.id)
+    return local_names - global_names, global_names
+
+
+def falls_through(body):
+    """
+    Test if execution may continue after a list of statements.
+    """
+    if not body:
+        return True
+    last = body[-1]
+    if isinstance(last, (ast.Return, ast.Break, ast.Continue)):
+        return False
+    elif isinstance(last, ast.If):
+        return falls_through(last.body) or falls_through(last.orelse)
+    else:
+        return True
+
+
+def is_constant(node):
+    return type(node).__name__ in ('Constant', 'Num', 'Str', 'NameConstant')
+
+
+def constant_value(node):
+    # Num and Str nodes (python < 3.8) have no value attribute
+    for attr in ('value', 'n', 's'):
+        if hasattr(node, attr):
+            return getattr(node, attr)
+
+
+CONSTANT_FOLDING = {
+    ast.Add: lambda x, y: x + y,
+    ast.Sub: lambda x, y: x - y,
+    ast.Mult: lambda x, y: x * y,
+    ast.FloorDiv: lambda x, y: x // y,
+    ast.Mod: lambda x, y: x % y,
+    ast.Pow: lambda x, y: x ** y}
+
+# maximum size in bits of folded powers
+MAX_FOLDED_POWER = 4096
+
+
+def folded_constant(node):
+    """
+    Return the value of an integer expression made of constants and
+    arithmetic operators, as folded by CPython, or None if the expression is
+    not constant or cannot be folded.
+    """
+    if is_constant(node):
+        value = constant_value(node)
+        if isinstance(value, numbers.Integral) and not isinstance(value, bool):
+            return value
+        else:
+            return None
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        x = folded_constant(node.operand)
+        if x is None:
+            return None
         else:
-            tmp.append(instr)
-    newcode = tmp
+            return x if isinstance(node.op, ast.UAdd) else -x
+    elif isinstance(node, ast.BinOp) and type(node.op) in CONSTANT_FOLDING:
+        x = folded_constant(node.left)
+        y = folded_constant(node.right)
+        if x is None or y is None:
+            return None
+        elif isinstance(node.op, (ast.FloorDiv, ast.Mod)) and y == 0:
+            return None
+        elif isinstance(node.op, ast.Pow) and (y < 0 or abs(x).bit_length() * y > MAX_FOLDED_POWER):
+            return None
+        else:
+            return CONSTANT_FOLDING[type(node.op)](x, y)
+    else:
+        return None
 
-    # add print definition
-    newcode.extend(PRINT())
 
-    if divmod_required(dis_code):
-        newcode.extend(DIVMOD_DEF())
+def constant_arg(value):
+    if isinstance(value, str):
+        return repr(value)
+    else:
+        return str(value)
 
-    if exit_required(dis_code):
-        newcode.extend(EXIT_DEF())
 
-    # return list of formated instructions
-    return pprint_opcode(newcode)
+# -- Control flow graph ------------------------------------------------------
 
 
-def current_loop(opcode, instr_pointer):
-    pointer = instr_pointer
-    depth = 1
-    while depth > 0:
-        pointer -= 1
-        if opcode[pointer] == 'POP_BLOCK':
-            depth += 1
-        if opcode[pointer].startswith('SETUP_LOOP'):
-            depth -= 1
+JUMP_OPCODES = ('JUMP', 'POP_JUMP_IF_TRUE', 'POP_JUMP_IF_FALSE',
+                'JUMP_IF_TRUE_OR_POP', 'JUMP_IF_FALSE_OR_POP')
 
-    assert opcode[pointer].startswith('SETUP_LOOP')
-    return pointer
+# opcodes after which execution does not continue with the next instruction
+TERMINAL_OPCODES = ('JUMP', 'RETURN_VALUE', 'EXIT')
 
 
-# -- Other code transformations ----------------------------------------------
+class BasicBlock(object):
+    """
+    Sequence of instructions entered only by its first instruction and left
+    only by its last one. Labels are the leading instructions of the block.
+    """
+    __slots__ = ('code', 'successors')
 
+    def __init__(self):
+        self.code = []
+        self.successors = []
 
-def replace_script_return_with_exit(code):
-    for index, instr in enumerate(code):
-        if 'RETURN_VALUE' in instr:
-            # replace script RETURN_VALUE (first RETURN_VALUE in disassembly) with EXIT
-            code[index] = 'EXIT'
-            # delete previous LOAD_CONST None
-            del code[index - 1]
-            break
+    def labels(self):
+        return [instr.label for instr in self.code if instr.is_label()]
 
+    def last(self):
+        return self.code[-1] if self.code else None
 
-def primitive_opcode(func):
-    return func.upper()
+
+def basic_blocks(code):
+    """
+    Split instructions into basic blocks and link each block to its
+    successors: the target of its jump, and the next block if execution may
+    continue after its last instruction.
+    """
+    blocks = []
+    block = None
+    for instr in code:
+        if block is None or (instr.is_label() and not all(x.is_label() for x in block.code)):
+            block = BasicBlock()
+            blocks.append(block)
+        block.code.append(instr)
+        if instr.opcode in JUMP_OPCODES or instr.opcode in TERMINAL_OPCODES:
+            block = None
+
+    block_of_label = dict()
+    for block in blocks:
+        for label in block.labels():
+            block_of_label[label] = block
+
+    for index, block in enumerate(blocks):
+        last = block.last()
+        if last.opcode in JUMP_OPCODES:
+            block.successors.append(block_of_label[last.arg])
+        if last.opcode not in TERMINAL_OPCODES and index + 1 < len(blocks):
+            block.successors.append(blocks[index + 1])
+
+    return blocks
+
+
+def is_entry_label(label):
+    """
+    Function labels are reached by name when calling functions. Other labels
+    are only reached by jumps.
+    """
+    return not label.isdigit()
 
 
-def inline_helper_opcodes(code):
+def optimize_control_flow(code, context):
     """
-    Detect following opcode sequences:
+    Simplify control flow:
+    - remove loop block markers (SETUP_LOOP, POP_BLOCK), useless once breaks
+      have been replaced with jumps,
+    - thread jumps: jumps to an unconditional jump go directly to its target,
+    - remove unconditional jumps to the next instruction,
+    - remove blocks not reachable from the start of the script or from a
+      function entry,
+    - remove labels which are not jump targets, merging consecutive blocks.
+    """
+    code = [instr for instr in code if instr.opcode not in ('SETUP_LOOP', 'POP_BLOCK')]
+
+    while True:
+        size = len(code)
+        thread_jumps(code)
+        code = remove_jumps_to_next(code)
+        code = remove_unreachable_blocks(code)
+        code = remove_unused_labels(code)
+        if len(code) == size:
+            return code
+
+
+def thread_jumps(code):
+    # instruction following each label
+    target_instr = dict()
+    for index, instr in enumerate(code):
+        if instr.is_label():
+            next_index = index
+            while next_index < len(code) and code[next_index].is_label():
+                next_index += 1
+            if next_index < len(code):
+                target_instr[instr.label] = code[next_index]
+
+    for instr in code:
+        if instr.opcode in JUMP_OPCODES:
+            visited = set()
+            target = instr.arg
+            while (target not in visited and target in target_instr and
+                   target_instr[target].opcode == 'JUMP'):
+                visited.add(target)
+                target = target_instr[target].arg
+            instr.arg = target
+
+
+def remove_jumps_to_next(code):
+    newcode = []
+    for index, instr in enumerate(code):
+        if instr.opcode == 'JUMP':
+            next_index = index + 1
+            next_labels = []
+            while next_index < len(code) and code[next_index].is_label():
+                next_labels.append(code[next_index].label)
+                next_index += 1
+            if instr.arg in next_labels:
+                continue
+        newcode.append(instr)
+    return newcode
+
+
+def remove_unreachable_blocks(code):
+    blocks = basic_blocks(code)
+    if not blocks:
+        return code
+
+    todo = [blocks[0]]
+    todo.extend(block for block in blocks
+                if any(is_entry_label(label) for label in block.labels()))
+    reachable = set()
+    while todo:
+        block = todo.pop()
+        if id(block) not in reachable:
+            reachable.add(id(block))
+            todo.extend(block.successors)
 
-        LOAD_GLOBAL is_positive|negative|is_odd|divide_by_two
-        XXX
-        CALL_FUNCTION 1 labelname
-        :labelname
+    return [instr for block in blocks if id(block) in reachable
+            for instr in block.code]
 
-    and replace with:
 
-        XXX
-        IS_POSITIVE|NEGATIVE|IS_ODD|DIVIDE_BY_TWO
+def remove_unused_labels(code):
+    targets = set(instr.arg for instr in code if instr.opcode in JUMP_OPCODES)
+    return [instr for instr in code
+            if not instr.is_label() or is_entry_label(instr.label) or
+            instr.label in targets]
 
-    This assumes the helper functions are called with arguments made of
-    variables, consts and operators, i.e. no call functions inside the XXX
-    sequence of opcodes.
+
+# -- Liveness of variables --------------------------------------------------
+
+
+def remove_dead_variables(code, context):
+    """
+    Liveness analysis of variables. The script and each function are analysed
+    separately:
+    - local variables in functions (LOAD_FAST, STORE_FAST),
+    - names in the script (LOAD_NAME, STORE_NAME), excluding functions and
+      names accessed from functions (LOAD_GLOBAL, STORE_GLOBAL).
+    Stores of variables never loaded afterwards are replaced with POP_TOP.
+    In the script, variables are deleted after their last use, and at the
+    beginning of blocks where they are no longer live, to shorten the hold
+    space. This is not done in functions as their local variables are
+    deleted on return, and deleting them earlier costs more than it saves.
     """
+    global_names = set(instr.arg for instr in code
+                       if instr.opcode in ('LOAD_GLOBAL', 'STORE_GLOBAL'))
+    for index, instr in enumerate(code[:-1]):
+        if instr.opcode == 'MAKE_FUNCTION':
+            global_names.add(code[index + 1].arg)
+
     newcode = []
-    i = 0
-    while i < len(code):
-        instr = code[i]
-        i += 1
-        opc, arg = scancode(instr)
-        if opc == 'LOAD_CONST':
-            if any(arg.startswith(_) for _ in numsed_lib.PRIMITIVES):
-                i += 2
-            else:
-                newcode.append(instr)
-        elif opc == 'LOAD_GLOBAL':
-            func = arg
-            if func not in numsed_lib.PRIMITIVES:
-                newcode.append(instr)
-            else:
-                argseq = []
-                while not code[i].startswith('CALL_FUNCTION'):
-                    argseq.append(code[i])
-                    i += 1
-                i += 1                                      # skip call and return label
-                newcode.extend(argseq)                      # append sequence
-                newcode.append(primitive_opcode(func))      # append opcode
-        elif opc == 'FUNCTION' and any(arg.startswith(_) for _ in numsed_lib.PRIMITIVES):
-            while not code[i].startswith('RETURN_VALUE'):   # ignore code from primitive
-                i += 1
-            i += 1
+    for region in code_regions(code):
+        if region[0].is_label() and is_entry_label(region[0].label):
+            region = region_liveness(region, 'LOAD_FAST', 'STORE_FAST')
         else:
-            newcode.append(instr)
+            region = region_liveness(region, 'LOAD_NAME', 'STORE_NAME',
+                                     'DELETE_NAME', global_names)
+        newcode.extend(region)
+    return newcode
+
+
+def code_regions(code):
+    """
+    Split code into the script and the functions, starting with their entry
+    label.
+    """
+    regions = [[]]
+    for instr in code:
+        if instr.is_label() and is_entry_label(instr.label) and regions[-1]:
+            regions.append([])
+        regions[-1].append(instr)
+    return regions
+
+
+def region_liveness(code, load_opc, store_opc, delete_opc=None, excluded=()):
+
+    def is_var(instr, opc):
+        return instr.opcode == opc and instr.arg not in excluded
+
+    blocks = basic_blocks(code)
+
+    # variables used before being defined (gen) and defined (kill) in blocks
+    gen = dict()
+    kill = dict()
+    for block in blocks:
+        gen[id(block)] = set()
+        kill[id(block)] = set()
+        for instr in block.code:
+            if is_var(instr, load_opc) and instr.arg not in kill[id(block)]:
+                gen[id(block)].add(instr.arg)
+            elif is_var(instr, store_opc):
+                kill[id(block)].add(instr.arg)
+
+    # backward data flow
+    live_in = dict((id(block), set()) for block in blocks)
+    live_out = dict((id(block), set()) for block in blocks)
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(blocks):
+            out = set()
+            for succ in block.successors:
+                out |= live_in[id(succ)]
+            inp = gen[id(block)] | (out - kill[id(block)])
+            if out != live_out[id(block)] or inp != live_in[id(block)]:
+                live_out[id(block)] = out
+                live_in[id(block)] = inp
+                changed = True
+
+    # variables live when entering the block from one of its predecessors
+    live_from_pred = dict((id(block), set()) for block in blocks)
+    for block in blocks:
+        for succ in block.successors:
+            live_from_pred[id(succ)] |= live_out[id(block)]
+
+    # no deletion is done without delete opcode, when the script ends without
+    # calling functions, or when the variable is stored again in the block
+    newcode = []
+    for block in blocks:
+        live = set(live_out[id(block)])
+        leaving = block.last().opcode in ('RETURN_VALUE', 'EXIT')
+        stored = set()
+        tail = []
+        for instr in reversed(block.code):
+            if instr.opcode == 'CALL_FUNCTION':
+                leaving = False
+            if is_var(instr, store_opc):
+                if instr.arg not in live:
+                    instr.opcode, instr.arg = 'POP_TOP', None    # dead store
+                else:
+                    live.remove(instr.arg)
+                    stored.add(instr.arg)
+            elif is_var(instr, load_opc):
+                if (delete_opc and not leaving and
+                        instr.arg not in live and instr.arg not in stored):
+                    tail.append(Instruction(delete_opc, instr.arg, line=instr.line))
+                live.add(instr.arg)
+                stored.discard(instr.arg)
+            tail.append(instr)
+        tail.reverse()
+
+        # delete variables live in a predecessor and dead in this block
+        labels = [instr for instr in tail if instr.is_label()]
+        body = tail[len(labels):]
+        newcode.extend(labels)
+        if delete_opc and not leaving:
+            dead = live_from_pred[id(block)] - live_in[id(block)] - kill[id(block)]
+            newcode.extend(Instruction(delete_opc, name) for name in sorted(dead))
+        newcode.extend(body)
     return newcode
 
 
+# -- Other code transformations ----------------------------------------------
+
+
+def primitive_opcode(func):
+    # builtins are compiled into the opcode of their name in scripts
+    if func in numsed_lib.BUILTIN_FUNCTIONS:
+        func = func[len('builtin_'):]
+    return func.upper()
+
+
 # print() is also a primitive but is handled as a function. Its opcode
-# snippets are inserted directly into opcodes in opcodes() function.
+# snippets are inserted directly into opcodes by the declarations and
+# definitions passes.
 
 
 def PRINT_DECL():
@@ -429,57 +1177,32 @@ def divmod_required(code):
     """
     load_name_detected = False
     label_name_detected = False
-    for _, opc, arg in scancodes(code):
-        if opc == 'LOAD_NAME' and arg == 'divmod':
+    for instr in code:
+        if instr.opcode == 'LOAD_NAME' and instr.arg == 'divmod':
             load_name_detected = True
-        elif opc == ':' and arg == 'divmod':
+        elif instr.label == 'divmod':
             label_name_detected = True
     return load_name_detected and not label_name_detected
 
 
 def exit_required(code):
-    for _, opc, arg in scancodes(code):
-        if opc in ('LOAD_GLOBAL', 'LOAD_NAME') and arg == 'exit':
+    for instr in code:
+        if instr.opcode in ('LOAD_GLOBAL', 'LOAD_NAME') and instr.arg == 'exit':
             return True
     else:
         return False
 
 
-def link_opcode(code):
-    """
-    After disassembly of functions, labels in each function starts from 0.
-    Update labels to have separate name spaces.
-    """
-    offset = 0
-    maxlabel = 0
-    for index, (instr, opc, arg) in enumerate(scancodes(code)):
-        if is_function_label(instr):
-            offset = maxlabel + 2
-            continue
-
-        if instr.startswith(':'):
-            label = offset + int(instr[1:])
-            code[index] = ':%d' % label
-            if label > maxlabel:
-                maxlabel = label
+# -- Passes ------------------------------------------------------------------
 
-        if 'JUMP' in opc or opc == 'SETUP_LOOP':
-            label = offset + int(arg)
-            code[index] = '%s %d' % (opc, label)
 
-
-def pprint_opcode(code):
-    newcode = []
-    for instr, opc, arg in scancodes(code):
-        if instr.startswith(':'):
-            newcode.append('')
-            newcode.append(instr)
-            continue
-        if arg is None:
-            newcode.append(instr)
-        else:
-            newcode.append('%-17s %s' % (opc, arg))
-    return newcode
+OPCODE_PASSES = common.PassManager(lambda code: '\n'.join(format_code(code)), phase='opcode')
+OPCODE_PASSES.register('codegen', generate_code)
+OPCODE_PASSES.register('declarations', add_declarations)
+OPCODE_PASSES.register('definitions', add_definitions)
+OPCODE_PASSES.register('control_flow', optimize_control_flow, level=1)
+OPCODE_PASSES.register('dead_variables', remove_dead_variables, level=2,
+                       requires=('control_flow',))
 
 
 # -- Opcode interpreter ------------------------------------------------------
@@ -499,15 +1222,13 @@ def interpreter(code, coverage=False):
     opcodes = list()
     labels = dict()
 
-    # remove empty lines, split opcode and argument, store label indexes
-    for x in code:
-        if x.strip() == '':
-            continue
-        opcode, argument = scancode(x)
-        if opcode[0] == ':':
-            opcode, argument = opcode[0], opcode[1:]
-            labels[argument] = len(opcodes)
-        opcodes.append((opcode, argument))
+    # split opcode and argument, store label indexes
+    for instr in code:
+        if instr.is_label():
+            labels[instr.label] = len(opcodes)
+            opcodes.append((':', instr.label))
+        else:
+            opcodes.append((instr.opcode, instr.arg))
 
     result = []
 
@@ -541,6 +1262,8 @@ def interpreter(code, coverage=False):
             stack.append(varnames[-1][arg])
         elif opc == 'STORE_FAST':
             varnames[-1][arg] = stack.pop()
+        elif opc == 'DELETE_NAME':
+            names.pop(arg, None)
         elif opc == 'POP_TOP':
             _ = stack.pop()
         elif opc == 'DUP_TOP':
@@ -570,8 +1293,9 @@ def interpreter(code, coverage=False):
             if n == 1:
                 stack.append(int(x))
             else:
-                for _ in range(n):
-                    stack.append(int(x.pop()))
+                # the tuple may be shared after DUP_TOP
+                for elt in reversed(x):
+                    stack.append(int(elt))
         elif opc == 'UNARY_NEGATIVE':
             tos = stack.pop()
             stack.append(-tos)
@@ -718,6 +1442,33 @@ def interpreter(code, coverage=False):
             tos = stack.pop()
             tos1 = stack.pop()
             stack.append([tos1 // tos, tos1 % tos])
+        elif opc == 'DIVIDE_BY_CONSTANT':
+            tos = stack.pop()
+            stack.append(tos // int(arg))
+        elif opc == 'MODULO_CONSTANT':
+            tos = stack.pop()
+            stack.append(tos % int(arg))
+        elif opc == 'DIVMOD_CONSTANT':
+            tos = stack.pop()
+            stack.append([tos // int(arg), tos % int(arg)])
+        elif opc == 'ISQRT':
+            tos = stack.pop()
+            stack.append(numsed_lib.builtin_isqrt(tos))
+        elif opc == 'GCD':
+            tos = stack.pop()
+            tos1 = stack.pop()
+            stack.append(numsed_lib.builtin_gcd(tos1, tos))
+        elif opc == 'MIN':
+            tos = stack.pop()
+            tos1 = stack.pop()
+            stack.append(min(tos1, tos))
+        elif opc == 'MAX':
+            tos = stack.pop()
+            tos1 = stack.pop()
+            stack.append(max(tos1, tos))
+        elif opc == 'NDIGITS':
+            tos = stack.pop()
+            stack.append(len(str(abs(tos))))
         elif opc == 'TRACE':
             pass
         elif opc == 'EXIT':
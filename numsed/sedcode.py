@@ -5,7 +5,6 @@ Generation of sed code for numsed.
 from __future__ import print_function
 
 import re
-import subprocess
 
 try:
     import common
@@ -16,17 +15,29 @@ except:
 
 
 class SedConversion(common.NumsedConversion):
-    def __init__(self, source, transformation):
-        common.NumsedConversion.__init__(self, source, transformation)
-        x = opcoder.OpcodeConversion(source, transformation)
-        opcodes = x.trace().splitlines()
-        self.sed = make_sed_header(source) + sedcode(opcodes)
+    def __init__(self, source, transformation, context=None, text=None):
+        common.NumsedConversion.__init__(self, source, transformation, context, text)
+        x = opcoder.OpcodeConversion(source, transformation, self.context, self.text)
+        self.opcode = x.opcode
+
+    def write(self, f):
+        """
+        Write the sed script to a file object. The script is generated
+        while written, one snippet at a time.
+        """
+        f.write(make_sed_header(self.source, self.text))
+        for line in self.lines():
+            f.write(line)
+            f.write('\n')
 
     def trace(self):
-        return self.sed
+        return make_sed_header(self.source, self.text) + '\n'.join(self.lines())
+
+    def lines(self):
+        return self.cached_lines('sed', lambda: sedcode(self.opcode, self.context))
 
     def run(self):
-        return run_sed(self.sed)
+        return run_sed(self)
 
     def print_run_result(self):
         return False
@@ -44,59 +55,304 @@ HEADER2 = '''\
 # https://github.com/GillesArcas/numsed
 '''
 
-def make_sed_header(source):
+def make_sed_header(source, text):
     if source.endswith('.py'):
-        with open(source) as f:
-            python = ''.join(['# ' + x for x in f.readlines()])
+        python = ''.join(['# ' + x for x in text.splitlines(True)])
         return HEADER1 % python
     elif source.endswith('.opc'):
         return HEADER2
     else:
         return ''
 
-def run_sed(sed):
-    # save sed script
-    with open(common.TMP_SED, 'w') as f:
-        print(sed, file=f)
+# the sed script is run on a minimal input given on stdin
+SED_INPUT = '0\n'
 
-    # save minimal input file
-    with open(common.TMP_INPUT, 'w') as f:
-        print('0', file=f)
 
-    com = 'sed -u -n -r -f %s %s' % (common.TMP_SED, common.TMP_INPUT)
+def run_sed(conversion, echo=True):
+    """
+    Run the sed script of a conversion and return its output. The script is
+    written in a private temporary file, hence runs do not interfere.
+    """
+    timings = conversion.context.timings
+    with common.TemporaryFile('.sed', conversion.write) as script:
+        with timings.phase('sed_spawn'):
+            p = common.start(['sed', '-n', '-r', '-f', script])
+        with timings.phase('sed_run'):
+            output = common.communicate(p, echo, SED_INPUT)
+        timings.process_memory('sed_run', p)
+        return output
 
-    if 0:
-        res = subprocess.check_output(com).decode('ascii')
-    else:
-        res = common.run(com)
 
-    return res
+def run_sed_lines(conversion):
+    """
+    Run the sed script of a conversion and yield its output lines as soon as
+    they are printed. sed flushes its output after each line (-u), which is
+    slower but required for live display.
+    """
+    timings = conversion.context.timings
+    with common.TemporaryFile('.sed', conversion.write) as script:
+        with timings.phase('sed_spawn'):
+            p = common.start(['sed', '-u', '-n', '-r', '-f', script])
+        for line in timings.iterate('sed_run', common.output_lines(p, SED_INPUT)):
+            yield line
+        timings.process_memory('sed_run', p)
+
+
+# -- Batches of programs -----------------------------------------------------
+
+
+# line printed at the end of each program of a batch, programs cannot print
+# it as '@' is not allowed in strings
+PROGRAM_DELIMITER = '@@'
+
+
+def run_sed_batch(opcodes, context):
+    """
+    Run the programs given by their opcodes in a single sed process and
+    return the list of their outputs. The programs are run in order, one by
+    input line.
+    """
+    def write(f):
+        for line in batch_sedcode(opcodes, context):
+            f.write(line)
+            f.write('\n')
+
+    sed_input = ''.join(program_label(index) + '\n' for index in range(len(opcodes)))
+    with common.TemporaryFile('.sed', write) as script:
+        with context.timings.phase('sed_spawn'):
+            p = common.start(['sed', '-n', '-r', '-f', script])
+        with context.timings.phase('sed_run'):
+            output = common.communicate(p, False, sed_input)
+        context.timings.process_memory('sed_run', p)
+
+    outputs = []
+    lines = []
+    for line in output.split('\n') if output else []:
+        if line == PROGRAM_DELIMITER:
+            outputs.append('\n'.join(lines))
+            lines = []
+        else:
+            lines.append(line)
+    # when sed stops on an error, the output of the interrupted program is
+    # returned and the next ones are empty
+    outputs.append('\n'.join(lines))
+    outputs.extend([''] * (len(opcodes) - len(outputs)))
+    return outputs[:len(opcodes)]
+
+
+def batch_sedcode(opcodes, context):
+    """
+    Return an iterator on the lines of a sed script running all programs.
+    """
+    return SED_PASSES.run(link_programs(opcodes), context, context)
+
+
+def program_label(index):
+    return 'P%d' % index
+
+
+def link_programs(opcodes):
+    """
+    Link several programs into a single code. Each program starts with its
+    label and the numeric labels of its script are prefixed with it. A
+    function defined identically by several programs is kept once, a
+    function with the same name but another code is renamed with the label
+    of the program.
+    """
+    code = [opcoder.Instruction('BATCH_STARTUP', str(len(opcodes)))]
+    functions = []
+    keys = dict()
+
+    for index, opcode in enumerate(opcodes):
+        prefix = program_label(index)
+
+        # function segments: from a function label to the next one
+        segments = []
+        for instr in opcode:
+            if instr.is_function_label():
+                segments.append([instr])
+            elif segments:
+                segments[-1].append(instr)
+        script = opcode[:len(opcode) - sum(len(x) for x in segments)]
+
+        renamed = dict()
+        for segment in segments:
+            label = segment[0].label
+            key = function_key(segment)
+            if keys.get(label, key) != key:
+                renamed[label] = '%s_%s' % (prefix.lower(), label)
+                segment = [opcoder.Instruction(label=renamed[label])] + segment[1:]
+                key = function_key(segment)
+            if renamed.get(label, label) not in keys:
+                keys[renamed.get(label, label)] = key
+                functions.extend(segment)
+
+        for instr in script:
+            if instr.opcode == 'STARTUP':
+                code.append(opcoder.Instruction(label=prefix))
+                code.append(opcoder.Instruction('INIT_STACK'))
+            elif instr.is_label():
+                code.append(opcoder.Instruction(label='%s_%s' % (prefix, instr.label)))
+            elif instr.opcode in opcoder.LABEL_OPCODES:
+                code.append(opcoder.Instruction(instr.opcode, '%s_%s' % (prefix, instr.arg)))
+            elif instr.opcode == 'LOAD_CONST' and instr.arg in renamed:
+                code.append(opcoder.Instruction(instr.opcode, renamed[instr.arg]))
+            else:
+                code.append(instr)
+
+    return code + functions
 
 
 # -- Generate sed code -------------------------------------------------------
 
 
-def sedcode(opcode):
-    global function_labels, return_labels
+def sedcode(opcode, context):
+    """
+    Return an iterator on the lines of the sed script. Lines are generated
+    on demand, so memory is bounded by the size of the largest snippet.
+    """
+    return SED_PASSES.run(opcode, context, context)
 
-    function_labels = ['print.func']
-    return_labels = []
 
+def expand_instructions(opcode, context):
+    """
+    Generate the sed snippets of the instructions, followed by the branches
+    to functions and to return addresses. Return labels are known once all
+    calls have been expanded. Labels are numbered from zero each time the
+    script is generated.
+    """
+    context.label_counter = 0
+    context.return_labels = []
+
+    if context.compact:
+        opcode = compact_variables(opcode)
+
+    function_labels = ['print.func']
     for instr in opcode:
-        if opcoder.is_function_label(instr):
-            function_labels.append(instr[1:].strip())
+        if instr.is_function_label():
+            function_labels.append(instr.label)
+
+    index = 0
+    while index < len(opcode):
+        instr = opcode[index]
+        if instr.is_function_label():
+            end = index + 1
+            while end < len(opcode) and not opcode[end].is_function_label():
+                end += 1
+            yield function_sedcode(opcode[index:end], context)
+            index = end
+        else:
+            yield instruction_sedcode(instr, context)
+            index += 1
+    return_labels = context.return_labels + ['end_of_script']
+    yield ':call_function\n' + BRANCH_ON_NAME(function_labels, context.new_label())
+    yield ':return\n' + BRANCH_ON_NAME(return_labels, context.new_label())
+
+
+def instruction_sedcode(instr, context):
+    """
+    Replace an instruction with sed instructions. Opcodes are expanded
+    directly, without parsing their text.
+    """
+    if instr.is_label():
+        return ':%s' % instr.label
+    else:
+        return expand_macro(instr.opcode, instr.arg, context)
+
 
-    sedcode = normalize('\n'.join(opcode))
-    return_labels += ['end_of_script']
-    sedcode += '\n:call_function\n' + BRANCH_ON_NAME(function_labels)
-    sedcode += '\n:return\n' + BRANCH_ON_NAME(return_labels)
+def function_name(instr):
+    return instr.label[:-len('.func')]
 
-    sedcode = prettyprint(sedcode)
 
-    return sedcode
+# sed code of library functions and their return labels, by code of the
+# functions with normalized labels. Shared by all compilations.
+fragments = dict()
 
 
-def normalize(snippet):
+def function_sedcode(code, context):
+    """
+    Replace the code of a function with sed instructions. The sed labels of
+    the function are prefixed with its name, which does not occur twice in a
+    program, so the sed code does not depend on the program and is expanded
+    once.
+    """
+    name = function_name(code[0])
+    key = function_key(code)
+
+    texts = function_fragments(name, context)
+    if key not in texts:
+        fragment_context = common.CompilerContext()
+        fragment_context.label_prefix = name + '.'
+        text = '\n'.join(instruction_sedcode(opcoder.Instruction(*x), fragment_context)
+                         for x in key)
+        texts[key] = (text, fragment_context.return_labels)
+
+    text, return_labels = texts[key]
+    context.return_labels.extend(return_labels)
+    return text
+
+
+def function_key(code):
+    """
+    Return the code of a function as a tuple of (opcode, arg, label) where
+    numeric labels are replaced with labels prefixed with the function name.
+    Two functions with the same key have the same sed code.
+    """
+    name = function_name(code[0])
+    labels = dict()
+
+    def normalize_label(label):
+        if label.isdigit():
+            return labels.setdefault(label, '%s.%d' % (name, len(labels)))
+        else:
+            return label
+
+    key = []
+    for instr in code:
+        if instr.is_label():
+            key.append((None, None, normalize_label(instr.label)))
+        elif instr.opcode in opcoder.LABEL_OPCODES:
+            key.append((instr.opcode, normalize_label(instr.arg), None))
+        else:
+            key.append((instr.opcode, instr.arg, None))
+    return tuple(key)
+
+
+def function_fragments(name, context):
+    # the sed code of library functions is kept for all compilations, the one
+    # of other functions in the fragments of the context
+    if opcoder.is_library_function(name):
+        return fragments
+    else:
+        return context.fragments
+
+
+# macros available in snippets: opcodes and auxiliary snippets
+MACROS = opcoder.OPCODES + (
+    'PUSH', 'POP', 'POP2', 'SWAP', 'POP_TOP', 'DUP_TOP',
+    'CHECKINT2', 'CMP', 'EQU', 'NEQ', 'UADD', 'USUB', 'UMUL', 'UPOW',
+    'FULLADD', 'FULLSUB', 'FULLMUL', 'MULBYDIGIT', 'DIVBY2', 'ODD',
+    'SCMP', 'USQRT', 'UGCD', 'UDIVMODK', 'DIVMODK',
+    'UMODK', 'MODK', 'ENCODE', 'DECODE', 'ENCODE_TOP', 'DECODE_TOP',
+    'INIT_STACK', 'ERROR_HANDLERS')
+
+MACRO_REGEX = re.compile(r'(?<!# )\b(%s)\b *([^#\n]*)' % '|'.join(MACROS))
+LABEL_REGEX = re.compile(r'^ *:(\.\S+)', re.MULTILINE)
+PLACEHOLDER_REGEX = re.compile('\x00(\\d+|R)\x00')
+
+# placeholder of the return address of a call, a template has at most one
+RETURN_PLACEHOLDER = '\x00R\x00'
+
+# expansions of macros by macro and argument. Templates do not depend on
+# the compilation and are shared by all compilations.
+templates = dict()
+
+
+def expand_macro(macro, arg, context):
+    return instantiate(macro_template(macro, arg), context)
+
+
+def normalize(snippet, context=None):
     r"""
     Replace opcodes with sed instructions.
 
@@ -106,63 +362,124 @@ def normalize(snippet):
       labels avoiding conflicts if the opcode is used several times.
     - \d, which does not exist in sed, is replaced with [0-9]
     """
-    labels = []
-    for line in snippet.splitlines():
-        m = re.match(r' *:(\.\S+)', line)
-        if m:
-            labels.append(m.group(1))
+    if context is None:
+        context = common.CompilerContext()
+    return instantiate(snippet_template(snippet), context)
+
+
+def macro_template(macro, arg=None):
+    """
+    Return the template of the expansion of a macro. Templates are computed
+    once for each macro and argument.
+    """
+    key = (macro, arg)
+    if key in templates:
+        return templates[key]
+
+    func = globals()[macro]
+    larg = [] if arg is None else [arg]
+    text, nlabels = snippet_template(func(*larg))
+    template = ('# %s %s\n' % (macro, '' if arg is None else arg) +
+                text + ('# %s/\n' % macro), nlabels)
 
-    for label in labels:
-        snippet = snippet.replace(label, new_label())
+    templates[key] = template
+    return template
 
-    macros = opcoder.OPCODES
 
-    macros += ('PUSH', 'POP', 'POP2', 'SWAP', 'POP_TOP', 'DUP_TOP',
-               'CHECKINT2', 'CMP', 'EQU', 'NEQ', 'UADD', 'USUB', 'UMUL',
-               'FULLADD', 'FULLSUB', 'FULLMUL', 'MULBYDIGIT', 'DIVBY2', 'ODD')
+def snippet_template(snippet):
+    """
+    Return the expansion of a snippet as a template: a text where labels are
+    replaced with numbered placeholders, and the number of placeholders.
+    Labels and macros are each replaced in a single pass over the snippet.
+    Placeholders of the expanded macros are numbered after the labels of
+    the snippet.
+    """
+    labels = dict()
+    for label in LABEL_REGEX.findall(snippet):
+        labels.setdefault(label, len(labels))
 
-    for macro in macros:
-        func = globals()[macro]
-        def repl(m):
-            arg = '' if not m.group(1) else m.group(1)
-            larg = [] if not arg else [arg]
-            return '# %s %s\n' % (macro, arg) + normalize(func(*larg)) + ('# %s/\n' % macro)
+    if labels:
+        # longest labels first when a label is a prefix of another one
+        regex = '|'.join(re.escape(x) for x in sorted(labels, key=len, reverse=True))
+        snippet = re.sub(regex, lambda m: placeholder(labels[m.group(0)]), snippet)
 
-        snippet = re.sub(r'(?<!# )\b%s\b *([^#\n]*)' % macro, repl, snippet)
+    nlabels = [len(labels)]
 
+    def repl(m):
+        text, n = macro_template(m.group(1), m.group(2) or None)
+        text = shift_placeholders(text, nlabels[0])
+        nlabels[0] += n
+        return text
+
+    snippet = MACRO_REGEX.sub(repl, snippet)
     snippet = snippet.replace('\\d', '[0-9]')
-    return snippet
+    return snippet, nlabels[0]
 
 
-label_counter = 0
-def new_label():
-    global label_counter
-    r = 'L%d' % label_counter
-    label_counter += 1
-    return r
+def placeholder(index):
+    return '\x00%d\x00' % index
 
 
-return_counter = 0
-def new_return():
-    global return_counter
-    r = 'R%d' % return_counter
-    return_counter += 1
-    return r
+def shift_placeholders(text, offset):
+    def repl(m):
+        if m.group(1) == 'R':
+            return RETURN_PLACEHOLDER
+        else:
+            return placeholder(int(m.group(1)) + offset)
+
+    if offset == 0:
+        return text
+    else:
+        return PLACEHOLDER_REGEX.sub(repl, text)
+
+
+def instantiate(template, context):
+    """
+    Replace the placeholders of a template with new labels of the context.
+    """
+    text, nlabels = template
+    labels = [context.new_label() for _ in range(nlabels)]
+    if RETURN_PLACEHOLDER in text:
+        labels.append(context.new_return_label())
+    return PLACEHOLDER_REGEX.sub(lambda m: labels[-1 if m.group(1) == 'R' else int(m.group(1))], text)
+
+
+COMMENT_REGEX = re.compile('^([^#]*)(#.*)')
+
+
+def prettyprint(snippets, context):
+    # snippets are separated by a line break. The sed code of functions is
+    # formatted once, as it is expanded once.
+    for snippet in snippets:
+        if opcoder.is_function_label(snippet):
+            name = snippet[1:snippet.index('.func')]
+            texts = function_fragments(name, context)
+            key = ('prettyprint', snippet)
+            if key not in texts:
+                texts[key] = list(prettyprint_snippet(snippet))
+            lines = texts[key]
+        else:
+            lines = prettyprint_snippet(snippet)
+        for line in lines:
+            yield line
 
 
-def prettyprint(sedcode):
-    sedcode2 = []
-    for instr in sedcode.splitlines():
+def prettyprint_snippet(snippet):
+    for instr in snippet.split('\n'):
         instr = instr.strip()
         if instr.startswith(':'):
             pass
         else:
             instr = '    ' + instr
-        m = re.match('^([^#]*)(#.*)', instr)
-        if m:
+        if '#' in instr:
+            m = COMMENT_REGEX.match(instr)
             instr = '%-40s%s' % (m.group(1).rstrip(), m.group(2))
-        sedcode2.append(instr)
-    return '\n'.join(sedcode2)
+        yield instr
+
+
+SED_PASSES = common.PassManager(lambda lines: '\n'.join(lines))
+SED_PASSES.register('expand', expand_instructions)
+SED_PASSES.register('prettyprint', prettyprint)
 
 
 # -- Startup -----------------------------------------------------------------
@@ -170,33 +487,67 @@ def prettyprint(sedcode):
 
 def STARTUP():
     snippet = r'''
-        x
-        s/.*/end_of_script;@/
-        x
+        INIT_STACK
         b.start
         :end_of_script
         q
+        ERROR_HANDLERS
+        :.start
+    '''
+    return snippet
+
+
+def INIT_STACK():
+    snippet = r'''
+        x
+        s/.*/end_of_script;@/
+        x
+    '''
+    return snippet
+
+
+def ERROR_HANDLERS():
+    snippet = r'''
         :NameError
         s/.*/NameError: name & is not defined/
         p
-        q
+        b end_of_script
         :UnknownLabel
         s/.*/UnknownLabel: label & is not defined/
         p
-        q
+        b end_of_script
         :NotPositiveInteger
         s/^([^;]+;[^;]+).*/NotPositiveInteger: an operand is not a positive integer: \1/
         p
-        q
+        b end_of_script
         :NotImplemented
         s/.*/NotImplemented: not available with --literal, use --unsigned or --signed: &/
         p
-        q
-        :.start
+        b end_of_script
+        :ValueError
+        s/.*/ValueError: &/
+        p
+        b end_of_script
     '''
     return snippet
 
 
+def BATCH_STARTUP(nprograms):
+    # the input line gives the program to run, the end of each program is
+    # marked by a delimiter line and the next line is read
+    snippet = r'''
+        b.start
+        :end_of_script
+        s/.*/%s/
+        p
+        d
+        ERROR_HANDLERS
+        :.start
+    ''' % PROGRAM_DELIMITER
+    labels = [program_label(index) for index in range(int(nprograms))]
+    return snippet + BRANCH_ON_NAME(labels, 'dispatch')
+
+
 # -- Stack -------------------------------------------------------------------
 
 
@@ -372,8 +723,21 @@ def STORE_GLOBAL(name):
     return snippet.replace('name', name)
 
 
+def DELETE_GLOBAL(name):
+    """
+    del name, no error if name is undefined
+    """
+    snippet = r'''                      # PS: ?         HS: X
+        g
+        s/(@[^|]*);name;[^;|]*/\1/      # PS: X'        HS: ? (del ;var;val in PS)
+        h                               # PS: ?         HS: X'
+    '''
+    return snippet.replace('name', name)
+
+
 STORE_NAME = STORE_GLOBAL
 LOAD_NAME = LOAD_GLOBAL
+DELETE_NAME = DELETE_GLOBAL
 
 
 def LOAD_FAST(name):
@@ -406,6 +770,89 @@ def STORE_FAST(name):
     return snippet.replace('name', name)
 
 
+# -- Compact values ----------------------------------------------------------
+
+
+# With --compact, integers stored in variables are encoded: each pair of digits
+# from 00 to 66 is replaced with a character of COMPACT_DIGITS, and the value
+# is prefixed with '='. The prefix prevents an encoded value to be taken for a
+# name. The characters avoid the separators of the hold space (;@|,~!), the
+# minus sign and the characters special in snippets and sed replacements.
+COMPACT_DIGITS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz$%()*+<>?[]^_{}'
+COMPACT_TABLE = ''.join('%02d%s' % (n, c) for n, c in enumerate(COMPACT_DIGITS))
+
+
+def compact_variables(opcode):
+    """
+    Encode values stored into variables and decode values loaded from
+    variables. Values in the stack are always decimal.
+    """
+    result = []
+    for instr in opcode:
+        if instr.opcode in ('STORE_NAME', 'STORE_GLOBAL', 'STORE_FAST'):
+            result.extend((opcoder.Instruction('ENCODE_TOP'), instr))
+        elif instr.opcode in ('LOAD_NAME', 'LOAD_GLOBAL', 'LOAD_FAST'):
+            result.extend((instr, opcoder.Instruction('DECODE_TOP')))
+        else:
+            result.append(instr)
+    return result
+
+
+def ENCODE():
+    """
+    Encode an integer. Pairs of digits found in the table are replaced,
+    rightmost first. Other values (function labels) are not changed.
+    """
+    snippet = r'''                      # PS: N
+        /^-?\d+$/ {
+            s/$/~table/                 # PS: N~00A01B...
+            t.loop                      # reset t flag
+            :.loop
+            s/^([^~]*)(\d\d)([^~]*~.*\2([^0-9]).*)/\1\4\3/
+            t.loop
+            s/~.*//
+            s/^/=/                      # PS: =N'
+        }
+    '''
+    return snippet.replace('table', COMPACT_TABLE)
+
+
+def DECODE():
+    """
+    Decode a value encoded by ENCODE. Other values are not changed.
+    """
+    snippet = r'''                      # PS: =N'
+        /^=/ {
+            s/^=//
+            s/$/~table/                 # PS: N'~00A01B...
+            t.loop                      # reset t flag
+            :.loop
+            s/^([^~]*)([^-0-9~])([^~]*~.*(\d\d)\2)/\1\4\3/
+            t.loop
+            s/~.*//                     # PS: N
+        }
+    '''
+    return snippet.replace('table', COMPACT_TABLE)
+
+
+def ENCODE_TOP():
+    snippet = r'''                      # PS: ?         HS: N;X
+        POP                             # PS: N         HS: X
+        ENCODE                          # PS: N'        HS: X
+        PUSH                            # PS: N'        HS: N';X
+    '''
+    return snippet
+
+
+def DECODE_TOP():
+    snippet = r'''                      # PS: ?         HS: N';X
+        POP                             # PS: N'        HS: X
+        DECODE                          # PS: N         HS: X
+        PUSH                            # PS: N         HS: N;X
+    '''
+    return snippet
+
+
 # -- Functions ---------------------------------------------------------------
 
 
@@ -417,8 +864,6 @@ def CALL_FUNCTION(argc):
     if int(argc) >= 256:
         raise Exception('numsed: keyword parameters not handled (argc: %s)' % argc)
 
-    return_label = new_return()
-    return_labels.append(return_label)
     nargs = '~' * int(argc)  # number of arguments unary encoded
 
     # argc parameters on top of stack above name of function
@@ -432,7 +877,7 @@ def CALL_FUNCTION(argc):
         b call_function
         :return_label
     '''
-    return snippet.replace('argc', argc).replace('return_label', return_label).replace('nargs', nargs)
+    return snippet.replace('argc', argc).replace('return_label', RETURN_PLACEHOLDER).replace('nargs', nargs)
 
 
 def RETURN_VALUE():
@@ -444,12 +889,12 @@ def RETURN_VALUE():
     return snippet
 
 
-def BRANCH_ON_NAME(labels):
+def BRANCH_ON_NAME(labels, test_label):
     snippet = r'''                      # PS: label
         t.test_return                   # t to next line to reset t flag
         :.test_return                   # PS: label
     '''
-    snippet = snippet.replace('test_return', new_label())
+    snippet = snippet.replace('test_return', test_label)
     snippet += '\n'.join(('s/^%s$//;t %s' % (label, label) for label in labels))
     snippet += '\nb UnknownLabel'
 
@@ -507,7 +952,7 @@ def POP_BLOCK():
 
 def EXIT():
     snippet = '''
-        q
+        b end_of_script
     '''
     return snippet
 
@@ -817,21 +1262,25 @@ def UMUL_python(a, b):  # for reference, not used
 def UMUL():
     """
     Multiply two integers
+
+    Input  PS: A;M;X
+    Output PS: R;X  with R = A * M (R alone if X is empty)
     """
-    snippet = r'''                      # PS: A;M;
-        s/^/0;;/                        # PS: 0;;A;M;
-        :.loop                          # PS: P;S;A;Mm;
+    snippet = r'''                      # PS: A;M;X
+        s/^/0;;/                        # PS: 0;;A;M;X
+        :.loop                          # PS: P;S;A;Mm;X
                                         # P partial result to add, S last digits
-        s/(\d*;\d*;(\d*;)\d*)(\d)/\3\2\1/
-                                        # PS: mA;P;S;A;M;
-        MULBYDIGIT                      # PS: B;P;S;A;M; (B = m * A)
-        UADD                            # PS: R;S;A;M    (R = B + P)
-                                        # PS: Rr;S;A;M;
-        s/(\d);/;\1/                    # PS: R;rS;A;M;
+        s/^(\d*;\d*;(\d*;)\d*)(\d)/\3\2\1/
+                                        # PS: mA;P;S;A;M;X
+        MULBYDIGIT                      # PS: B;P;S;A;M;X (B = m * A)
+        UADD                            # PS: R;S;A;M;X   (R = B + P)
+                                        # PS: Rr;S;A;M;X
+        s/(\d);/;\1/                    # PS: R;rS;A;M;X
         s/^;/0;/                        # R is the partial result to add, if empty put 0
-        /\d; *$/b.loop                  # Loop if still digits in M
-                                        # PS: R;S;A;;
-        s/(\d*);(\d*).*/\1\2/           # PS: RS
+        /^\d*;\d*;\d*;\d/b.loop         # Loop if still digits in M
+                                        # PS: R;S;A;;X
+        s/^(\d*);(\d*);\d*;;(.)/\1\2;\3/ # PS: RS;X
+        s/^(\d*);(\d*);\d*;;$/\1\2/     # PS: RS if X is empty
         s/^0*(.)/\1/                    # Normalize leading zeros
     '''
     return snippet
@@ -867,14 +1316,311 @@ def BINARY_MODULO():
     '''
 
 
-def BINARY_POWER():
+def DIVMOD():
     # not implemented in sed, implemented in python
     return '''
-        s/.*/power/
+        s/.*/divmod/
         b NotImplemented
     '''
 
 
+# -- Exponentiation ----------------------------------------------------------
+
+
+def UPOW():
+    """
+    Raise an integer to an integer power (left to right binary exponentiation)
+
+    Input  PS: B;E;X
+    Output PS: R;X  with R = B ** E (R alone if X is empty)
+
+    The exponent is converted to binary first, then the result is squared for
+    each bit and multiplied by the base for each bit set. Single digit bases
+    are multiplied with MULBYDIGIT, powers of ten only handle strings of zeros.
+    """
+    snippet = r'''                      # PS: B;E;X
+        /^\d+;0;/{                      # B ** 0 = 1
+            s/^(\d+);0;/1;;\1;/
+            b.done
+        }
+        /^[01];/{                       # 0 ** E = 0 and 1 ** E = 1
+            s/^(.);\d+;/\1;;\1;/
+            b.done
+        }
+        s/^(\d+);(\d+);/\2;;\1;/        # PS: E;;B;X
+        :.bin                           # PS: E;bits;B;X
+        s/^(\d*[13579]);/\1;1/          # prepend low bit of E to bits
+        s/^(\d*[02468]);/\1;0/
+        DIVBY2                          # PS: E//2;bits;B;X
+        /^0;/!b.bin
+                                        # PS: 0;1bits;B;X
+        s/^0;1([01]*);(\d+);/\2;\1;\2;/ # PS: R;bits;B;X  with R = B
+        /^10*;/b.ten
+        :.loop                          # PS: R;bits;B;X
+        /^\d+;;/b.done
+        s/^(\d+);/\1;\1;/               # PS: R;R;bits;B;X
+        UMUL                            # PS: R;bits;B;X  with R = R * R
+        /^\d+;0/{
+            s/;0/;/                     # bit 0: square only
+            b.loop
+        }
+        s/;1/;/                         # bit 1: square and multiply by base
+        /^\d+;[01]*;\d;/{               # single digit base
+            s/^(\d+);([01]*);(\d);/\3\1;\2;\3;/
+            MULBYDIGIT                  # PS: R;bits;B;X  with R = R * B
+            b.loop
+        }
+        s/^(\d+);([01]*);(\d+);/\3;\1;\2;\3;/
+        UMUL                            # PS: R;bits;B;X  with R = R * B
+        b.loop
+        :.ten                           # PS: 1Z;bits;1K;X  (Z, K: zeros)
+        /^\d+;;/b.done
+        /^\d+;0/{
+            s/^1(0*);0/1\1\1;/          # bit 0: square only
+            b.ten
+        }
+        s/^1(0*);1([01]*);1(0*);/1\1\1\3;\2;1\3;/
+                                        # bit 1: square and multiply by base
+        b.ten
+        :.done                          # PS: R;;B;X
+        s/^(\d+);;\d+;(.)/\1;\2/        # PS: R;X
+        s/^(\d+);;\d+;$/\1/             # PS: R if X is empty
+    '''
+    return snippet
+
+
+def BINARY_POWER():
+    """
+    Implements TOS = TOS1 ** TOS on unsigned integers (R = N ** M).
+    """
+    snippet = r'''                      # PS: ?         HS: M;N;X
+        SWAP
+        POP2                            # PS: N;M       HS: X
+        CHECKINT2
+        s/$/;/
+        UPOW                            # PS: R         HS: X
+        PUSH                            # PS: R         HS: R;X
+     '''
+    return snippet
+
+
+# -- Division by constants ---------------------------------------------------
+
+
+SMALL_DIVISOR_MAX = 16
+
+
+def is_power_of_ten(k):
+    return k >= 10 and str(k).strip('0') == '1'
+
+
+def UDIVMODK(k):
+    """
+    Divide an integer by a constant (long division)
+
+    Input  PS: N;X
+    Output PS: Q;R;X  with Q, R = divmod(N, k)
+
+    The divisor is known at compile time. Powers of ten split the digits of N.
+    For small divisors, a lookup table gives the quotient digit and the new
+    remainder from the current remainder and the next digit of N. For larger
+    divisors, the multiples of the divisor are compared in decreasing order
+    with the current remainder.
+    """
+    k = int(k)
+    if is_power_of_ten(k):
+        snippet = r'''                  # PS: N;X
+        s/^/ZEROS/                      # PS: 0..0N;X
+        s/^(\d*)(\d{NDIGITS});/\1;\2;/  # PS: Q;R;X
+        s/^;/0;/
+        '''
+        snippet = snippet.replace('ZEROS', '0' * (len(str(k)) - 1))
+        snippet = snippet.replace('NDIGITS', str(len(str(k)) - 1))
+    elif k <= SMALL_DIVISOR_MAX:
+        width = len(str(k - 1))
+        lut = []
+        for r in range(k):
+            for d in range(10):
+                q, r2 = divmod(r * 10 + d, k)
+                lut.append('!%0*d%d%d%0*d' % (width, r, d, q, width, r2))
+        snippet = r'''                  # PS: N;X
+        s/^(\d+);/ZEROS;\1;;/           # PS: r;N;Q;X
+        :.loop                          # PS: r;nN;Q;X
+        s/^(\d+);(\d)/\1\2;/            # PS: rn;N;Q;X
+        s/^(\d+);/\1LUT;/               # PS: rn!L;N;Q;X  L lookup table
+        s/^(\d+)[^;]*!\1(\d)(\d+)[^;]*;([^;]*);([^;]*);/\3;\4;\5\2;/
+                                        # PS: r;N;Qq;X
+        /^\d+;\d/b.loop
+        s/^(\d+);;(\d+);/\2;\1;/        # PS: Q;R;X
+        '''
+        snippet = snippet.replace('ZEROS', '0' * width)
+        snippet = snippet.replace('LUT', ''.join(lut))
+    else:
+        table = ''.join('%d,%d!' % (d, d * k) for d in range(9, 0, -1))
+        snippet = r'''                  # PS: N;X
+        s/^(\d+);/0;\1;;/               # PS: r;N;Q;X
+        :.loop                          # PS: r;nN;Q;X
+        s/^(\d+);(\d)/\1\2;TABLE;/      # PS: rn;T;N;Q;X  T multiples of k
+        s/^0(\d)/\1/
+        :.try                           # PS: r;d,m!T;N;Q;X
+        /^\d+;;/{                       # no multiple lower than r
+            s/^(\d+);;([^;]*);([^;]*);/\1;\2;\30;/
+            b.next
+        }
+        s/^(\d+);(\d),(\d+)!/\1;\3:\2:\1:/
+                                        # PS: r;m:d:r:T;N;Q;X
+        USUB                            # PS: r-m:d:r:T;N;Q;X
+        /^NAN/{
+            s/^NAN:\d:(\d+):/\1;/       # PS: r;T;N;Q;X
+            b.try
+        }
+        s/^(\d+):(\d):\d+:[^;]*;([^;]*);([^;]*);/\1;\3;\4\2;/
+                                        # PS: r;N;Qq;X
+        :.next
+        /^\d+;\d/b.loop
+        s/^(\d+);;(\d+);/\2;\1;/        # PS: Q;R;X
+        '''
+        snippet = snippet.replace('TABLE', table)
+    snippet += r'''                     # PS: Q;R;X
+        s/^0*(\d)/\1/                   # normalize leading zeros
+        s/;0*(\d)/;\1/
+    '''
+    return snippet
+
+
+def UMODK(k):
+    """
+    Modulo of an integer by a constant
+
+    Input  PS: N
+    Output PS: R  with R = N % k
+
+    No quotient is computed for the following divisors:
+    - 2, 5 and powers of ten: the last digits of N are kept,
+    - 3 and 9: the residues of the digits are summed in unary,
+    - 11: the residues of the pairs of digits are summed in unary (as
+      100 % 11 == 1, the residue of a pair of digits ab is b - a modulo 11).
+    Other divisors use the long division.
+    """
+    k = int(k)
+    if k in (2, 5):
+        lut = ''.join('!%d%d' % (d, d % k) for d in range(10))
+        snippet = r'''                  # PS: N
+        s/^\d*(\d)$/\1LUT/
+        s/^(\d).*!\1(\d).*/\2/          # PS: R
+        '''
+        snippet = snippet.replace('LUT', lut)
+    elif is_power_of_ten(k):
+        snippet = r'''                  # PS: N
+        s/^\d*(\d{NDIGITS})$/\1/        # keep last digits
+        s/^0*(\d)/\1/                   # PS: R
+        '''
+        snippet = snippet.replace('NDIGITS', str(len(str(k)) - 1))
+    elif k in (3, 9, 11):
+        lines = []
+        if k == 11:
+            lines.append(r's/^\d(\d\d)*$/0&/')      # even number of digits
+            lines.append(r's/(\d)(\d)/\1a\2/g')     # mark tens digits
+            for d in range(10):
+                lines.append('s/%da/%s/g' % (d, '1' * (10 * d % k)))
+        for d in (0, 2, 3, 4, 5, 6, 7, 8, 9):
+            lines.append('s/%d/%s/g' % (d, '1' * (d % k)))
+        lines.append('s/1{%d}//g' % k)
+        for r in range(k - 1, 0, -1):
+            lines.append('s/^1{%d}$/%d/' % (r, r))
+        lines.append('s/^$/0/')
+        snippet = '\n'.join(lines)
+    else:
+        snippet = r'''                  # PS: N
+        s/$/;/
+        UDIVMODK DIVISOR                # PS: Q;R;
+        s/^\d+;(\d+);/\1/               # PS: R
+        '''
+        snippet = snippet.replace('DIVISOR', str(k))
+    return snippet
+
+
+def MODK(k):
+    """
+    Modulo of a signed integer by a positive constant
+
+    Input  PS: N
+    Output PS: R  with R = N % k
+    """
+    snippet = r'''                      # PS: N
+        /^-/b.neg
+        UMODK DIVISOR                   # PS: R
+        b.end
+        :.neg
+        s/^-//                          # PS: A  with A = -N
+        UMODK DIVISOR                   # PS: R  with R = A % k
+        /^0$/b.end
+        s/^.*/DIVISOR;&;/               # PS: k;R;
+        USUB                            # PS: k-R;
+        s/;$//                          # PS: k-R
+        :.end
+    '''
+    return snippet.replace('DIVISOR', str(int(k)))
+
+
+def DIVMODK(k):
+    """
+    Divide a signed integer by a positive constant
+
+    Input  PS: N;X
+    Output PS: Q;R;X  with Q, R = divmod(N, k)
+    """
+    snippet = r'''                      # PS: N;X
+        /^-/b.neg
+        UDIVMODK DIVISOR                # PS: Q;R;X
+        b.end
+        :.neg
+        s/^-//                          # PS: A;X  with A = -N
+        UDIVMODK DIVISOR                # PS: Q;R;X  with Q, R = divmod(A, k)
+        /^\d+;0;/b.sign
+        s/^(\d+);(\d+);/DIVISOR;\2;\1;/ # PS: k;R;Q;X
+        USUB                            # PS: k-R;Q;X
+        s/^(\d+);(\d+);/\2;1;\1;/       # PS: Q;1;k-R;X
+        UADD                            # PS: Q+1;k-R;X
+        :.sign
+        s/^/-/                          # PS: -Q;R;X
+        :.end
+    '''
+    return snippet.replace('DIVISOR', str(int(k)))
+
+
+def DIVIDE_BY_CONSTANT(k):
+    snippet = r'''                      # PS: ?         HS: N;X
+        g                               # PS: N;X       HS: N;X
+        DIVMODK DIVISOR                 # PS: Q;R;X     HS: N;X
+        s/;[^;]*//                      # PS: Q;X       HS: N;X
+        h                               # PS: Q;X       HS: Q;X  Q = N // k
+    '''
+    return snippet.replace('DIVISOR', str(int(k)))
+
+
+def MODULO_CONSTANT(k):
+    snippet = r'''                      # PS: ?         HS: N;X
+        g                               # PS: N;X       HS: N;X
+        s/;.*//                         # PS: N         HS: N;X
+        MODK DIVISOR                    # PS: R         HS: N;X
+        G                               # PS: R\nN;X    HS: N;X
+        s/\n[^;]*//                     # PS: R;X       HS: N;X
+        h                               # PS: R;X       HS: R;X  R = N % k
+    '''
+    return snippet.replace('DIVISOR', str(int(k)))
+
+
+def DIVMOD_CONSTANT(k):
+    snippet = r'''                      # PS: ?         HS: N;X
+        g                               # PS: N;X       HS: N;X
+        DIVMODK DIVISOR                 # PS: Q;R;X     HS: N;X
+        s/;/,/                          # PS: Q,R;X     HS: N;X
+        h                               # PS: Q,R;X     HS: Q,R;X  Q,R = divmod(N, k)
+    '''
+    return snippet.replace('DIVISOR', str(int(k)))
+
+
 # -- Helper opcodes ----------------------------------------------------------
 
 
@@ -970,6 +1716,202 @@ def DIVMOD10():
     return snippet
 
 
+# -- Builtin functions -------------------------------------------------------
+
+
+def SCMP():
+    """
+    Compare two signed integers
+
+    Input  PS: X;Y;
+    Output PS: <|=|>  comparison of X with Y
+    """
+    snippet = r'''                      # PS: X;Y;
+        /^-\d+;\d/{                     # X < 0 <= Y
+            s/.*/</
+            b.end
+        }
+        /^\d+;-/{                       # Y < 0 <= X
+            s/.*/>/
+            b.end
+        }
+        s/^-(\d+);-(\d+);/\2;\1;/       # X, Y < 0: compare -Y with -X
+        CMP
+        :.end                           # PS: <|=|>
+    '''
+    return snippet
+
+
+def MIN():
+    snippet = r'''                      # PS: ?         HS: M;N;X
+        g                               # PS: M;N;X     HS: M;N;X
+        s/^([^;]*;[^;]*;).*/\1/         # PS: M;N;      HS: M;N;X
+        SCMP                            # PS: <|=|>     HS: M;N;X
+        G                               # PS: c\nM;N;X  HS: M;N;X
+        s/^<\n([^;]*;)[^;]*;/\1/        # PS: M;X       if M < N
+        s/^[=>]\n[^;]*;//               # PS: N;X       if M >= N
+        h                               # PS: R;X       HS: R;X  R = min(N, M)
+    '''
+    return snippet
+
+
+def MAX():
+    snippet = r'''                      # PS: ?         HS: M;N;X
+        g                               # PS: M;N;X     HS: M;N;X
+        s/^([^;]*;[^;]*;).*/\1/         # PS: M;N;      HS: M;N;X
+        SCMP                            # PS: <|=|>     HS: M;N;X
+        G                               # PS: c\nM;N;X  HS: M;N;X
+        s/^>\n([^;]*;)[^;]*;/\1/        # PS: M;X       if M > N
+        s/^[<=]\n[^;]*;//               # PS: N;X       if M <= N
+        h                               # PS: R;X       HS: R;X  R = max(N, M)
+    '''
+    return snippet
+
+
+def NDIGITS():
+    snippet = r'''                      # PS: ?         HS: N;X
+        g                               # PS: N;X       HS: N;X
+        s/;.*//                         # PS: N
+        s/^-//
+        y/0123456789/aaaaaaaaaa/        # PS: U         one a per digit
+        s/$/;/                          # PS: U;        HS: N;X
+        :.loop                          # PS: U;R       U unary, R decimal
+        s/a{10}/b/g                     # PS: B;R       with U = 10 * B + A
+        s/^(b*)(a*);/\1;\29876543210;/  # PS: B;A9876543210;R
+        s/;.{9}(.)\d*;/;\1/             # PS: B;aR      with a = len(A)
+        y/b/a/
+        /^a/b.loop
+        s/^;//                          # PS: R         HS: N;X
+        G                               # PS: R\nN;X    HS: N;X
+        s/\n[^;]*//                     # PS: R;X       HS: N;X
+        h                               # PS: R;X       HS: R;X  R = ndigits(N)
+    '''
+    return snippet
+
+
+def USQRT():
+    """
+    Integer square root of an integer (digit by digit method)
+
+    Input  PS: N
+    Output PS: R  with R = isqrt(N)
+
+    For each pair of digits, the next digit of the root is the number of odd
+    numbers 20 * P + 1, 20 * P + 3, ... which can be subtracted from the
+    remainder, P being the root computed so far.
+    """
+    snippet = r'''                      # PS: N
+        /^(\d\d)*$/!s/^/0/              # even number of digits
+        s/$/;0;0/                       # PS: N;R;P     R remainder, P root
+        :.pair                          # PS: abN;R;P
+        s/^(\d\d)(\d*);(\d+);/\2;\3\1;/ # PS: N;Rab;P
+        s/^(\d*);0*(\d)/\1;\2/          # remove leading zeros from remainder
+        s/^(\d*);(\d+);(\d+)$/2\3;\2;;\1;\3/
+                                        # PS: 2P;R;D;N;P  D unary digit
+        MULBYDIGIT                      # PS: T;R;D;N;P   T = 2 * P
+        s/^(\d+)/\11/                   # PS: T;R;D;N;P   T = 20 * P + 1
+        s/^0*(\d)/\1/
+        :.sub                           # PS: T;R;D;N;P
+        s/^(\d+);(\d+);/\2;\1;\1;\2;/   # PS: R;T;T;R;D;N;P
+        USUB                            # PS: R-T;T;R;D;N;P or NAN;T;R;D;N;P
+        /^NAN/b.digit
+        s/^(\d+);(\d+);\d+;/\2;2;\1;x/  # PS: T;2;R;D;N;P R = R - T, D = D + 1
+        UADD                            # PS: T;R;D;N;P   T = T + 2
+        b.sub
+        :.digit                         # PS: NAN;T;R;D;N;P
+        s/^NAN;\d+;(\d+);(x*);(\d*);(\d+)$/\3;\1;\4!\29876543210/
+                                        # PS: N;R;P!D9876543210
+        s/!.{9}(.)\d*$/\1/              # PS: N;R;Pd
+        s/;0*(\d+)$/;\1/                # remove leading zeros from root
+        /^\d/b.pair
+        s/^;\d+;//                      # PS: P
+    '''
+    return snippet
+
+
+def ISQRT():
+    snippet = r'''                      # PS: ?         HS: N;X
+        POP                             # PS: N         HS: X
+        /^-/{
+            s/.*/isqrt() argument must be nonnegative/
+            b ValueError
+        }
+        USQRT                           # PS: R         HS: X
+        PUSH                            # PS: R         HS: R;X  R = isqrt(N)
+    '''
+    return snippet
+
+
+def UGCD():
+    """
+    Greatest common divisor of two integers (binary method)
+
+    Input  PS: U;V
+    Output PS: G  with G = gcd(U, V)
+    """
+    snippet = r'''                      # PS: U;V
+        s/$/;/                          # PS: U;V;K     K unary count of factors 2
+        /^0;/{
+            s/^0;(\d+);/\1/             # gcd(0, V) = V
+            b.end
+        }
+        /^\d+;0;/{
+            s/;0;//                     # gcd(U, 0) = U
+            b.end
+        }
+        :.two                           # PS: U;V;K
+        /^\d*[02468];\d*[02468];/{      # U and V even
+            DIVBY2
+            s/^(\d+);(\d+);/\2;\1;/
+            DIVBY2
+            s/^(\d+);(\d+);/\2;\1;x/    # PS: U;V;K       K = K + 1
+            b.two
+        }
+        :.oddu
+        /^\d*[02468];/{                 # U even
+            DIVBY2
+            b.oddu
+        }
+        :.loop                          # PS: U;V;K       U odd
+        /^\d+;0;/b.shift
+        /^\d+;\d*[02468];/{             # V even
+            s/^(\d+);(\d+);/\2;\1;/
+            DIVBY2
+            s/^(\d+);(\d+);/\2;\1;/
+            b.loop
+        }
+        s/^(\d+);(\d+);/\2;\1;\1;\2;/   # PS: V;U;U;V;K
+        USUB                            # PS: V-U;U;V;K or NAN;U;V;K
+        /^NAN/{
+            s/^NAN;(\d+);(\d+);/\1;\2;\2;/
+            USUB                        # PS: U-V;V;K
+            s/^(\d+);(\d+);/\2;\1;/     # PS: V;U-V;K
+            b.loop
+        }
+        s/^(\d+);(\d+);\d+;/\2;\1;/     # PS: U;V-U;K
+        b.loop
+        :.shift                         # PS: G;0;K
+        /x$/{
+            s/^(\d+);0;x/2\1;0;/
+            MULBYDIGIT                  # PS: G;0;K       G = 2 * G, K = K - 1
+            b.shift
+        }
+        s/;0;$//                        # PS: G
+        :.end
+    '''
+    return snippet
+
+
+def GCD():
+    snippet = r'''                      # PS: ?         HS: M;N;X
+        POP2                            # PS: M;N       HS: X
+        s/-//g                          # gcd of absolute values
+        UGCD                            # PS: R         HS: X
+        PUSH                            # PS: R         HS: R;X  R = gcd(N, M)
+    '''
+    return snippet
+
+
 # -- Printing ----------------------------------------------------------------
 
 
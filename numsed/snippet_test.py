@@ -5,18 +5,24 @@ import random
 
 try:
     import common
+    from numsed_lib import builtin_isqrt as isqrt, builtin_gcd as gcd
     from sedcode import (normalize,
                     STARTUP, MAKE_CONTEXT, POP_CONTEXT, PUSH, POP,
                     LOAD_GLOBAL, STORE_GLOBAL, LOAD_FAST, STORE_FAST,
                     CMP, FULLADD, FULLSUB, UADD, USUB, FULLMUL,
-                    MULBYDIGIT, UMUL, DIVBY2, ODD, EQU)
+                    MULBYDIGIT, UMUL, UPOW, DIVBY2, ODD, EQU,
+                    SCMP, USQRT, UGCD, UDIVMODK, UMODK,
+                    ENCODE, DECODE, COMPACT_DIGITS)
 except:
     from . import common
+    from .numsed_lib import builtin_isqrt as isqrt, builtin_gcd as gcd
     from .sedcode import (normalize,
                     STARTUP, MAKE_CONTEXT, POP_CONTEXT, PUSH, POP,
                     LOAD_GLOBAL, STORE_GLOBAL, LOAD_FAST, STORE_FAST,
                     CMP, FULLADD, FULLSUB, UADD, USUB, FULLMUL,
-                    MULBYDIGIT, UMUL, DIVBY2, ODD, EQU)
+                    MULBYDIGIT, UMUL, UPOW, DIVBY2, ODD, EQU,
+                    SCMP, USQRT, UGCD, UDIVMODK, UMODK,
+                    ENCODE, DECODE, COMPACT_DIGITS)
 
 
 def random_ndigits(n):
@@ -562,6 +568,60 @@ def test_umul_7():
     return test_gen('UMUL_7', UMUL, inplist, outlist)
 
 
+def test_upow_1():
+    '''
+    test power of all integers less or equal 20 with exponents less or equal 20
+    Input  PS: B;E;
+    Output PS: R   with R = B**E
+    '''
+    inplist = list()
+    outlist = list()
+    for b in range(21):
+        for e in range(21):
+            inplist.append('%d;%d;' % (b, e))
+            outlist.append('%d' % (b ** e,))
+
+    return test_gen('UPOW_1', UPOW, inplist, outlist)
+
+
+def test_upow_2():
+    '''
+    test powers of 2 and powers of powers of 10 (special cases)
+    Input  PS: B;E;
+    Output PS: R   with R = B**E
+    '''
+    inplist = list()
+    outlist = list()
+    for e in range(0, 200, 7):
+        for b in (2, 10, 100, 1000):
+            inplist.append('%d;%d;' % (b, e))
+            outlist.append('%d' % (b ** e,))
+
+    return test_gen('UPOW_2', UPOW, inplist, outlist)
+
+
+def test_upow_3():
+    '''
+    test power of random integers with random exponents, keeping context
+    Input  PS: B;E;X
+    Output PS: R;X  with R = B**E
+    '''
+    inplist = list()
+    outlist = list()
+    for _ in range(20):
+        b = random.randint(0, 10 ** 5)
+        e = random.randint(0, 20)
+        rest = random_content()
+        if rest:
+            inplist.append('%d;%d;%s' % (b, e, rest))
+            outlist.append('%d;%s' % (b ** e, rest))
+        else:
+            inplist.append('%d;%d;' % (b, e))
+            outlist.append('%d' % (b ** e,))
+
+    return test_gen('UPOW_3', UPOW, inplist, outlist)
+
+
 def test_divby2_1():
     '''
     test division by 2 for all integers below 100
@@ -611,18 +671,228 @@ def test_odd():
     return test_gen('ODD', ODD, inplist, outlist)
 
 
-def test_gen(descr, func, inplist, outlist):
-    with open(common.TMP_SED, 'w') as f:
-        print(normalize(func()), file=f)
+def test_scmp():
+    '''
+    test signed comparison of all integers between -20 and 20
+    Input  PS: X;Y;
+    Output PS: <|=|>
+    '''
+    inplist = list()
+    outlist = list()
+    for a in range(-20, 21):
+        for b in range(-20, 21):
+            inplist.append('%d;%d;' % (a, b))
+            outlist.append('<' if a < b else '=' if a == b else '>')
 
-    with open(common.TMP_INPUT, 'w') as f:
-        for line in inplist:
-            print(line, file=f)
+    return test_gen('SCMP', SCMP, inplist, outlist)
 
-    com = 'sed -r -f %s %s' % (common.TMP_SED, common.TMP_INPUT)
 
-    #res = subprocess.check_output(com).decode('ascii').splitlines()
-    res = common.run(com, echo=False).splitlines()
+def test_usqrt_1():
+    '''
+    test integer square root of all integers below 1000
+    Input  PS: N
+    Output PS: R  with R = isqrt(N)
+    '''
+    inplist = list()
+    outlist = list()
+    for n in range(1000):
+        inplist.append('%d' % n)
+        outlist.append('%d' % isqrt(n))
+
+    return test_gen('USQRT_1', USQRT, inplist, outlist)
+
+
+def test_usqrt_2():
+    '''
+    test integer square root of squares of random integers and their
+    neighbours
+    Input  PS: N
+    Output PS: R  with R = isqrt(N)
+    '''
+    inplist = list()
+    outlist = list()
+    for _ in range(20):
+        x = random_ndigits(random.randint(1, 30))
+        for n in (x * x - 1, x * x, x * x + 1):
+            inplist.append('%d' % n)
+            outlist.append('%d' % isqrt(n))
+
+    return test_gen('USQRT_2', USQRT, inplist, outlist)
+
+
+def test_ugcd_1():
+    '''
+    test greatest common divisor of all integers less or equal 40
+    Input  PS: U;V
+    Output PS: G  with G = gcd(U, V)
+    '''
+    inplist = list()
+    outlist = list()
+    for a in range(41):
+        for b in range(41):
+            inplist.append('%d;%d' % (a, b))
+            outlist.append('%d' % gcd(a, b))
+
+    return test_gen('UGCD_1', UGCD, inplist, outlist)
+
+
+def test_ugcd_2():
+    '''
+    test greatest common divisor of random integers with common factors
+    Input  PS: U;V
+    Output PS: G  with G = gcd(U, V)
+    '''
+    inplist = list()
+    outlist = list()
+    for _ in range(20):
+        g = random_ndigits(random.randint(1, 10))
+        a = g * random_ndigits(random.randint(1, 10))
+        b = g * random_ndigits(random.randint(1, 10))
+        inplist.append('%d;%d' % (a, b))
+        outlist.append('%d' % gcd(a, b))
+
+    return test_gen('UGCD_2', UGCD, inplist, outlist)
+
+
+def test_udivmodk_1():
+    '''
+    test division of all integers less than 1000 by a small constant
+    Input  PS: N;
+    Output PS: Q;R;  with Q, R = divmod(N, 7)
+    '''
+    inplist = list()
+    outlist = list()
+    for n in range(1000):
+        inplist.append('%d;' % n)
+        outlist.append('%d;%d;' % divmod(n, 7))
+
+    return test_gen('UDIVMODK_1', lambda: UDIVMODK(7), inplist, outlist)
+
+
+def test_udivmodk_2():
+    '''
+    test division of random integers by a large constant
+    Input  PS: N;
+    Output PS: Q;R;  with Q, R = divmod(N, 12345)
+    '''
+    inplist = list()
+    outlist = list()
+    for _ in range(20):
+        n = random_ndigits(random.randint(1, 20))
+        inplist.append('%d;' % n)
+        outlist.append('%d;%d;' % divmod(n, 12345))
+
+    return test_gen('UDIVMODK_2', lambda: UDIVMODK(12345), inplist, outlist)
+
+
+def test_umodk_1():
+    '''
+    test modulo of all integers less than 1000 by 9 (sum of digits)
+    Input  PS: N
+    Output PS: R  with R = N % 9
+    '''
+    inplist = list()
+    outlist = list()
+    for n in range(1000):
+        inplist.append('%d' % n)
+        outlist.append('%d' % (n % 9))
+
+    return test_gen('UMODK_1', lambda: UMODK(9), inplist, outlist)
+
+
+def test_umodk_2():
+    '''
+    test modulo of random integers by 11 (alternating sum of digits)
+    Input  PS: N
+    Output PS: R  with R = N % 11
+    '''
+    inplist = list()
+    outlist = list()
+    for _ in range(100):
+        n = random_ndigits(random.randint(1, 20))
+        inplist.append('%d' % n)
+        outlist.append('%d' % (n % 11))
+
+    return test_gen('UMODK_2', lambda: UMODK(11), inplist, outlist)
+
+
+def compact_value(x):
+    # python reference of ENCODE, the rightmost pair of digits is replaced first
+    while True:
+        for i in reversed(range(len(x) - 1)):
+            pair = x[i:i + 2]
+            if pair.isdigit() and int(pair) < len(COMPACT_DIGITS):
+                x = x[:i] + COMPACT_DIGITS[int(pair)] + x[i + 2:]
+                break
+        else:
+            return '=' + x
+
+
+def test_encode_1():
+    '''
+    test encoding of integers, function labels are not encoded
+    Input  PS: N
+    Output PS: =N'
+    '''
+    inplist = ['print.func']
+    outlist = ['print.func']
+    for n in list(range(-200, 1000)) + [random_ndigits(random.randint(1, 30)) for _ in range(100)]:
+        inplist.append('%d' % n)
+        outlist.append(compact_value('%d' % n))
+
+    return test_gen('ENCODE_1', ENCODE, inplist, outlist)
+
+
+def test_encode_2():
+    '''
+    test decoding of encoded integers
+    Input  PS: N
+    Output PS: N
+    '''
+    inplist = ['print.func']
+    outlist = ['print.func']
+    for n in list(range(-200, 1000)) + [-random_ndigits(random.randint(1, 30)) for _ in range(100)]:
+        inplist.append('%d' % n)
+        outlist.append('%d' % n)
+
+    return test_gen('ENCODE_2', lambda: ENCODE() + DECODE(), inplist, outlist)
+
+
+def test_context_5():
+    '''
+    store and load compact values of global and local variables
+    '''
+    inplist = ['0']
+    outlist = ['end_of_script;@;y;%s;x;%s|;z;%s' % tuple(compact_value(x) for x in ('-9999', '123456', '8000700'))]
+    return test_gen('context_5', snippet_context_5, inplist, outlist)
+
+
+def snippet_context_5():
+    snippet = '''
+        STARTUP
+        LOAD_CONST 123456
+        ENCODE_TOP
+        STORE_NAME x
+        LOAD_CONST -9999
+        ENCODE_TOP
+        STORE_NAME y
+        MAKE_CONTEXT
+        LOAD_GLOBAL x
+        DECODE_TOP
+        LOAD_CONST 7877244
+        BINARY_ADD
+        ENCODE_TOP
+        STORE_FAST z
+        x
+        '''
+    return snippet
+
+
+def test_gen(descr, func, inplist, outlist):
+    snippet = normalize(func())
+    with common.TemporaryFile('.sed', lambda f: print(snippet, file=f)) as script:
+        res = common.run(['sed', '-r', '-f', script], False, ''.join(x + '\n' for x in inplist))
+    res = res.splitlines()
 
     if res == outlist:
         print('%-15s %s' % (descr, 'OK'))
@@ -664,9 +934,24 @@ def main():
                   test_umul_5(),
                   test_umul_6(),
                   test_umul_7(),
+                  test_upow_1(),
+                  test_upow_2(),
+                  test_upow_3(),
                   test_divby2_1(),
                   test_divby2_2(),
-                  test_odd(),))
+                  test_odd(),
+                  test_scmp(),
+                  test_usqrt_1(),
+                  test_usqrt_2(),
+                  test_ugcd_1(),
+                  test_ugcd_2(),
+                  test_udivmodk_1(),
+                  test_udivmodk_2(),
+                  test_umodk_1(),
+                  test_umodk_2(),
+                  test_encode_1(),
+                  test_encode_2(),
+                  test_context_5(),))
 
     print('OK' if result else 'FAIL')
     return result
@@ -40,7 +40,14 @@ class PrepareTransformer(ast.NodeTransformer):
     """
     - replace augmented assignments with standard assignments
     - replace chained comparisons with and of comparisons
+    - replace pow function with two arguments with power operator
+    - rename calls of builtins with the names of their definitions in
+      numsed_lib
+    Calls of pow and of builtins hidden by definitions of the script are not
+    changed.
     """
+    def __init__(self, builtin_calls=()):
+        self.builtin_calls = builtin_calls
 
     def visit_AugAssign(self, node):
         self.generic_visit(node)
@@ -62,6 +69,19 @@ class PrepareTransformer(ast.NodeTransformer):
                 left = comparator
             return ast.BoolOp(op=ast.And(), values=list_compare)
 
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if node not in self.builtin_calls:
+            return node
+        elif node.func.id == 'pow':
+            if len(node.args) == 2:
+                return ast.BinOp(left=node.args[0], op=ast.Pow(), right=node.args[1])
+            else:
+                return node
+        else:
+            node.func.id = 'builtin_' + node.func.id
+            return node
+
 
 # -- Generic transformer -----------------------------------------------------
 
@@ -73,14 +93,22 @@ class NumsedTransformer(ast.NodeTransformer):
         self.required_func = set()
 
     def transform(self, tree):
+        # calls of pow with three arguments not hidden by a definition of
+        # the script
+        self.builtin_calls = common.builtin_calls(tree, ('pow',))
         self.visit(tree)
         if common.PY2:
             # remove import
             tree.body = tree.body[1:]
 
+        # primitives called in script
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call) and node.func.id in numsed_lib.PRIMITIVES:
+                self.required_func.add(node.func.id)
+
         libfuncs = self.required_func
         libfuncs = function_calls(libfuncs)
-        libfuncs = [getattr(numsed_lib, x) for x in libfuncs if x not in ('exit', 'print')]
+        libfuncs = [x for x in libfuncs if x not in ('exit', 'print')]
 
         for func in libfuncs:
             functree = getfuncast(func)
@@ -89,19 +117,69 @@ class NumsedTransformer(ast.NodeTransformer):
         ast.fix_missing_locations(tree)
 
     def make_call(self, operator, *args):
-        func = self.func[type(operator)]
+        return self.make_func_call(self.func[type(operator)], *args)
+
+    def make_func_call(self, func, *args):
         self.required_func.add(func)
-        return ast.Call(func=ast.Name(id=func, ctx=ast.Load()),
-                        args=list(args),
-                        keywords=[], starargs=None, kwargs=None)
+        return make_call_node(func, *args)
+
+
+def make_call_node(func, *args):
+    return ast.Call(func=ast.Name(id=func, ctx=ast.Load()),
+                    args=list(args),
+                    keywords=[], starargs=None, kwargs=None)
 
 
 class IdentityTransformer(NumsedTransformer):
     pass
 
 
-def getfuncast(func):
-    funcdef = ''.join(inspect.getsourcelines(func)[0])
+# -- Division by constants ---------------------------------------------------
+
+
+CONSTANT_DIVISION_FUNC = {
+    ast.FloorDiv: 'divide_by_constant',
+    ast.Mod: 'modulo_constant'}
+
+
+def is_positive_constant(node):
+    return isinstance(node, ast.Num) and node.n > 0
+
+
+def is_constant_division(node):
+    """
+    Division and modulo by positive constants are replaced with primitives
+    specialized at compile time for the divisor.
+    """
+    return type(node.op) in CONSTANT_DIVISION_FUNC and is_positive_constant(node.right)
+
+
+class ConstantDivisionTransformer(ast.NodeTransformer):
+    """
+    - replace x // k and x % k with divide_by_constant(x, k) and
+      modulo_constant(x, k)
+    - replace divmod(x, k) with divmod_constant(x, k)
+    Applied before the unsigned and signed transformers which leave these
+    primitives unchanged.
+    """
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if is_constant_division(node):
+            func = CONSTANT_DIVISION_FUNC[type(node.op)]
+            return make_call_node(func, node.left, node.right)
+        else:
+            return node
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if node.func.id == 'divmod' and is_positive_constant(node.args[1]):
+            node.func.id = 'divmod_constant'
+        return node
+
+
+def getfuncast(funcname):
+    funcdef = library_source(funcname)
     if common.PY2:
         funcdef = FUTURE_FUNCTION + funcdef
     funcast = ast.parse(funcdef)
@@ -113,21 +191,40 @@ def getfuncast(func):
 # -- List of library functions -----------------------------------------------
 
 
+# sources of library functions and names of the functions they call, read
+# once from numsed_lib
+library_sources = dict()
+library_calls = dict()
+
+
+def library_source(funcname):
+    if funcname not in library_sources:
+        func = getattr(numsed_lib, funcname)
+        library_sources[funcname] = ''.join(inspect.getsourcelines(func)[0])
+    return library_sources[funcname]
+
+
 def called_functions(funcname):
     """
     func is the name of a function. Returns the names of all functions called
     in func.
     """
-    func = getattr(numsed_lib, funcname, None)
-    if func is None:
+    if funcname not in library_calls:
+        library_calls[funcname] = library_called_functions(funcname)
+    return library_calls[funcname]
+
+
+def library_called_functions(funcname):
+    if not inspect.isfunction(getattr(numsed_lib, funcname, None)):
         return set()
-    functext = '\n'.join(inspect.getsourcelines(func)[0])
-    tree = ast.parse(functext)
+    tree = ast.parse(library_source(funcname))
     called = set()
     for node in ast.walk(tree):
         if isinstance(node, ast.Call):
             # it is tested in checker.check that node.func is an ast.Name
-            called.add(node.func.id)
+            # python functions used in the definition of primitives are ignored
+            if node.func.id in ('exit', 'print') or hasattr(numsed_lib, node.func.id):
+                called.add(node.func.id)
     return called
 
 
@@ -151,8 +248,7 @@ def function_calls(libfuncs):
 
 UNSIGNED_FUNC = {
     ast.FloorDiv: 'udiv',
-    ast.Mod: 'umod',
-    ast.Pow: 'upow'}
+    ast.Mod: 'umod'}
 
 
 class UnsignedTransformer(NumsedTransformer):
@@ -172,6 +268,9 @@ class UnsignedTransformer(NumsedTransformer):
         if node.func.id == 'divmod':
             node.func.id = 'udivmod'
             self.required_func.add('udivmod')
+        elif node in self.builtin_calls:
+            node.func.id = 'upowmod'
+            self.required_func.add('upowmod')
         self.generic_visit(node)
         return node
 
@@ -213,6 +312,9 @@ class SignedTransformer(NumsedTransformer):
         if node.func.id == 'divmod':
             node.func.id = 'signed_divmod'
             self.required_func.add('signed_divmod')
+        elif node in self.builtin_calls:
+            node.func.id = 'signed_powmod'
+            self.required_func.add('signed_powmod')
         self.generic_visit(node)
         return node
 
@@ -278,7 +380,7 @@ class AssertTransformer(NumsedTransformer):
         return self.make_call(node.ops[0], node.left, node.comparators[0])
 
     def visit_FunctionDef(self, node):
-        if node.name in ('is_positive', 'abs'):
+        if node.name in numsed_lib.SIGNED_PRIMITIVES:
             return node
         else:
             self.generic_visit(node)
@@ -324,24 +426,49 @@ def rec_node(node, level, indent, write):
         print(')', sep='', end='')
 
 
+# -- Passes ------------------------------------------------------------------
+
+
+def prepare(tree, transformation):
+    PrepareTransformer(common.builtin_calls(tree, numsed_lib.BUILTINS + ('pow',))).visit(tree)
+    return tree
+
+
+def constant_division(tree, transformation):
+    if transformation in (UNSIGNED, SIGNED):
+        ConstantDivisionTransformer().visit(tree)
+    return tree
+
+
+def positive_form(tree, transformation):
+    transformers = {
+        LITERAL: IdentityTransformer,
+        UNSIGNED: UnsignedTransformer,
+        SIGNED: SignedTransformer
+    }
+    transformer = transformers[transformation]()
+    transformer.transform(tree)
+    return tree
+
+
+AST_PASSES = common.PassManager(codegen.to_source, phase='transform')
+AST_PASSES.register('prepare', prepare)
+AST_PASSES.register('constant_division', constant_division, level=2)
+AST_PASSES.register('positive_form', positive_form)
+
+
 # -- Ast conversion ----------------------------------------------------------
 
 
 class AstConversion(common.NumsedConversion):
-    def __init__(self, source, transformation):
-        common.NumsedConversion.__init__(self, source, transformation)
-        sourcelines = open(source).read()
+    def __init__(self, source, transformation, context=None, text=None):
+        common.NumsedConversion.__init__(self, source, transformation, context, text)
+        sourcelines = self.text
         if common.PY2:
             sourcelines = FUTURE_FUNCTION + sourcelines
-        self.tree = ast.parse(sourcelines)
-        transformers = {
-            LITERAL: IdentityTransformer,
-            UNSIGNED: UnsignedTransformer,
-            SIGNED: SignedTransformer
-        }
-        PrepareTransformer().visit(self.tree)
-        transformer = transformers[transformation]()
-        transformer.transform(self.tree)
+        with self.context.timings.phase('transform'):
+            self.tree = ast.parse(sourcelines)
+        self.tree = AST_PASSES.run(self.tree, self.context, transformation)
 
     def trace(self):
         print(ast.dump(self.tree))
@@ -351,7 +478,7 @@ class AstConversion(common.NumsedConversion):
 
     def run(self):
         try:
-            with common.ListStream() as x:
+            with common.ListStream() as x, common.ModulePath(self.directory()):
                 code = compile(self.tree, filename="<ast>", mode="exec")
                 # giving a new namespace is necessary to avoid exec interfering
                 # with current context (x variable from with construct)
@@ -365,8 +492,8 @@ class AstConversion(common.NumsedConversion):
 
 
 class AstAssertConversion(AstConversion):
-    def __init__(self, source, transformation):
-        AstConversion.__init__(self, source, transformation)
+    def __init__(self, source, transformation, context=None, text=None):
+        AstConversion.__init__(self, source, transformation, context, text)
         if self.transformation in (UNSIGNED, SIGNED):
             transformer = AssertTransformer()
             transformer.transform(self.tree)
@@ -377,8 +504,8 @@ class AstAssertConversion(AstConversion):
 
 
 class ScriptConversion(AstAssertConversion):
-    def __init__(self, source, transformation):
-        AstAssertConversion.__init__(self, source, transformation)
+    def __init__(self, source, transformation, context=None, text=None):
+        AstAssertConversion.__init__(self, source, transformation, context, text)
         self.code = codegen.to_source(self.tree)
 
     def trace(self):
@@ -386,7 +513,7 @@ class ScriptConversion(AstAssertConversion):
 
     def run(self):
         try:
-            with common.ListStream() as x:
+            with common.ListStream() as x, common.ModulePath(self.directory()):
                 code = compile(self.code, filename="<script>", mode="exec")
                 exec(code, {})
         except SystemExit:
@@ -37,7 +37,8 @@ if __name__ == "__main__":
         data_files=[('', ['LICENSE', 'README.md'])],
         py_package='test.suite.py',
         entry_points={
-            'console_scripts': ['numsed = numsed.numsed:numsed_main']
+            'console_scripts': ['numsed = numsed.numsed:numsed_main',
+                                'numsed-client = numsed.daemon:main']
         },
         zip_safe=True,
     )
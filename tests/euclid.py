@@ -0,0 +1,11 @@
+# numsed module imported by test suites
+
+
+def euclid(a, b):
+    while b != 0:
+        a, b = b, a % b
+    return a
+
+
+def lcm(a, b):
+    return a * b // euclid(a, b)
@@ -0,0 +1,17 @@
+# numsed module imported by test suites
+
+from euclid import euclid
+
+
+def inverse(a, n):
+    if euclid(a, n) != 1:
+        return 0
+    t, newt = 0, 1
+    r, newr = n, a
+    while newr != 0:
+        q = r // newr
+        t, newt = newt, t - q * newt
+        r, newr = newr, r - q * newr
+    if t < 0:
+        t = t + n
+    return t
@@ -106,6 +106,22 @@ n = 5
 p = m ** n
 print(p)
 # ---
+# power special cases
+m = 0
+n = 1
+print(m ** m, m ** 5, n ** 100, 7 ** n)
+m = 100
+print(2 ** m, 10 ** m)
+n = 7
+print(1000 ** n, 12345 ** n)
+# ---
+# power of negative base
+m = -3
+n = 0
+while n <= 5:
+    print(m ** n)
+    n += 1
+# ---
 # Exponent should be positive
 m = 42
 n = -1
@@ -440,6 +456,56 @@ while m <= 10:
     if m + n == 13:
         continue
 # ---
+# jumps to jumps and unreachable code
+def f(x):
+    while x < 100:
+        if x > 3:
+            if x > 5:
+                return x
+            else:
+                x += 3
+        else:
+            x += 1
+            continue
+        break
+    return -x
+n = 0
+while n < 8:
+    if n % 2:
+        if n > 4:
+            print(f(n))
+        else:
+            print(n)
+    else:
+        print(f(-n))
+    n += 1
+# ---
+# boolean operators in conditions and nested loops
+def f(x, y):
+    global count
+    count += 1
+    while x > 0:
+        x -= 1
+        if not (x % 3 and y) or x == 7 and not y:
+            continue
+        while y < x:
+            y += 2
+            if y == 5 or y == 9:
+                break
+        else:
+            return x + y
+    else:
+        return -1 if y else 0
+    return x * 10 + y
+count = 0
+n = 0
+while n < 12:
+    print(f(n, n % 4), n and f(n, 0) or n)
+    n += 1
+a = b = -n
+c, d = e, f = n, a
+print(count, a, b, c, d, e, f)
+# ---
 # loop on unary positive
 n = -10
 while n <= 10:
@@ -517,6 +583,45 @@ while m <= 10:
         n += 1
     m += 1
 # ---
+# loop on division by constants
+m = -30
+while m <= 30:
+    q, r = divmod(m, 7)
+    print(m // 3, m % 3, m // 7, m % 7, q, r)
+    m += 1
+# ---
+# division by large constants
+m = 98765432109876543210
+n = -m
+print(m // 1000, m % 1000, n // 1000, n % 1000)
+print(m // 12345, m % 12345, n // 12345, n % 12345)
+q, r = divmod(n, 250)
+print(q, r, m // 1, m % 1)
+# ---
+# modulo by digit based divisors
+m = -30
+while m <= 30:
+    print(m % 2, m % 5, m % 10, m % 100, m % 3, m % 9, m % 11)
+    m += 1
+m = 98765432109876543210
+n = -m
+print(m % 2, m % 5, m % 1000, m % 3, m % 9, m % 11)
+print(n % 2, n % 5, n % 1000, n % 3, n % 9, n % 11)
+print(m // 1000, n // 1000, m // 10, n // 10)
+# ---
+# dead variables
+a = 12345678901234567890
+b = a * 2
+c = 7
+c = b + a
+print(c)
+n = 0
+while n < 3:
+    t = n * n
+    print(t)
+    n += 1
+print(n)
+# ---
 # loop on power
 m = -10
 while m <= 10:
@@ -527,6 +632,81 @@ while m <= 10:
         n += 1
     m += 1
 # ---
+# loop on modular power
+b = -5
+while b <= 5:
+    m = -4
+    while m <= 4:
+        if m != 0:
+            print(pow(b, 0, m), pow(b, 3, m), pow(b, 10, m))
+        m += 3
+    b += 2
+# ---
+# modular power with big exponent
+print(pow(2, 1000, 1000000007), pow(7, 10 ** 20 + 1, 10 ** 10))
+# ---
+# pow with two arguments
+x = pow(-2, 7)
+print(x, pow(3, 4) + 1)
+# ---
+# pow modulo zero
+print(pow(2, 3, 0))
+# ===
+numsed error: pow() 3rd argument cannot be 0
+# ---
+# pow number of arguments
+x = pow(2)
+# ===
+numsed error: line 2 col 5: pow requires two or three arguments
+x = pow(2)
+    ^
+# ---
+# pow hidden by a function of the script
+def pow(a, b):
+    return a + b
+print(pow(2, 3))
+# ---
+# pow hidden by a variable of the script
+def f(a, b, c):
+    return a * b + c
+pow = f
+print(pow(2, 3, 4))
+# ---
+# builtin functions
+x = -10
+while x <= 10:
+    print(min(x, 3), max(x, -3), gcd(x, 6), ndigits(x * 1000), isqrt(x * x + 3))
+    x += 3
+# ---
+# builtin functions with calls as arguments
+def minimum(x, y):
+    return x if x < y else y
+print(max(minimum(3, 4), minimum(2, 5) + 1), min(minimum(-2, 0) - 10, gcd(12, 8 * 2)))
+print(ndigits(2 ** 100), isqrt(10 ** 40), gcd(2 ** 40 * 3, 6 ** 20))
+# ---
+# builtin functions number of arguments
+x = gcd(4)
+# ===
+numsed error: line 2 col 5: wrong number of arguments
+x = gcd(4)
+    ^
+# ---
+# builtin functions hidden by functions of the script
+def gcd(x, y, z):
+    return x + y - z
+def f(x):
+    max = x * 2
+    return max + min(x, -1)
+print(gcd(3, 4, 10), f(5), f(-5), max(2, -7))
+# ---
+# builtin functions hidden by variables
+max = -3
+def f(x):
+    global ndigits
+    ndigits = x
+    return isqrt(x)
+print(max, f(17), ndigits, min(max, 2))
+# ---
 # exit
 i = 0
 while i < 10:
@@ -1054,3 +1234,26 @@ numsed error: line 3 col 12: divmod results must be assigned immediately
     return divmod(x, y)
            ^
 # ---
+# functions imported from modules compiled separately
+from modular import inverse
+from euclid import lcm
+
+print(inverse(17, 3120), inverse(6, 9), lcm(-12, 18))
+# ---
+# imported names must be defined in module
+from euclid import inverse
+# ===
+numsed error: line 2 col 1: cannot import name inverse
+from euclid import inverse
+^
+# ---
+# imported functions may not be redefined
+from euclid import lcm
+
+def euclid(a, b):
+    return 0
+# ===
+numsed error: line 2 col 1: name euclid conflicts with function of module euclid
+from euclid import lcm
+^
+# ---
@@ -99,6 +99,15 @@ n = 5
 p = m ** n
 print(p)
 # ---
+# power special cases
+m = 0
+n = 1
+print(m ** m, m ** 5, n ** 100, 7 ** n)
+m = 100
+print(2 ** m, 10 ** m)
+n = 7
+print(1000 ** n, 12345 ** n)
+# ---
 # assign expression
 m = 42
 n = 5
@@ -374,6 +383,41 @@ while m <= 10:
         n += 1
     m += 1
 # ---
+# loop on division by constants
+m = 0
+while m <= 30:
+    q, r = divmod(m, 7)
+    print(m // 3, m % 3, m // 7, m % 7, q, r)
+    m += 1
+# ---
+# division by large constants
+m = 98765432109876543210
+print(m // 1000, m % 1000, m // 12345, m % 12345)
+q, r = divmod(m, 250)
+print(q, r, m // 1, m % 1)
+# ---
+# modulo by digit based divisors
+m = 0
+while m <= 30:
+    print(m % 2, m % 5, m % 10, m % 100, m % 3, m % 9, m % 11)
+    m += 1
+m = 98765432109876543210
+print(m % 2, m % 5, m % 1000, m % 3, m % 9, m % 11)
+print(m // 1000, m // 10)
+# ---
+# dead variables
+a = 12345678901234567890
+b = a * 2
+c = 7
+c = b + a
+print(c)
+n = 0
+while n < 3:
+    t = n * n
+    print(t)
+    n += 1
+print(n)
+# ---
 # loop on power
 m = 0
 while m <= 10:
@@ -384,6 +428,29 @@ while m <= 10:
         n += 1
     m += 1
 # ---
+# loop on modular power
+b = 0
+while b <= 10:
+    print(pow(b, 0, 7), pow(b, 1, 7), pow(b, 13, 7), pow(b, 5, 1))
+    b += 1
+n = 1000
+print(pow(2, n, 1000000007), pow(2, n))
+# ---
+# builtin functions
+x = 0
+while x <= 20:
+    print(min(x, 7), max(x, 7), gcd(x, 12), ndigits(x * 1000), isqrt(x * x + 3))
+    x += 3
+print(ndigits(2 ** 100), isqrt(10 ** 40), gcd(2 ** 40 * 3, 6 ** 20))
+# ---
+# builtin functions hidden by definitions of the script
+def isqrt(n):
+    return n + 1
+def f(x):
+    min = x * 2
+    return min + max(x, 3)
+print(isqrt(4), f(1), f(5), min(2, 7))
+# ---
 # comparison operators
 m = 0
 while m <= 2: